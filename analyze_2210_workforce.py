@@ -8,11 +8,12 @@ Outputs:
 """
 
 from pathlib import Path
-from huggingface_hub import hf_hub_download
 import pandas as pd
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+from opm_data import resolve_file
+
 load_dotenv()
 
 HF_USERNAME = "abigailhaddad"
@@ -26,10 +27,9 @@ CHANGE_MONTHS = ["202502", "202503", "202504", "202505", "202506",
 
 
 def download_dataset(data_type: str, month: str) -> pd.DataFrame:
-    """Download a single month's dataset."""
+    """Load a single month's dataset (local copy if fresh, otherwise downloaded)."""
     repo_id = f"{HF_USERNAME}/opm-federal-{data_type}-{month}"
-    path = hf_hub_download(repo_id=repo_id, filename="data.parquet", repo_type="dataset")
-    return pd.read_parquet(path)
+    return pd.read_parquet(resolve_file(repo_id))
 
 
 def get_baseline_counts() -> pd.DataFrame:
@@ -41,7 +41,7 @@ def get_baseline_counts() -> pd.DataFrame:
     it_df = df[df["occupational_series_code"] == SERIES_CODE]
     it_df["count"] = pd.to_numeric(it_df["count"], errors="coerce").fillna(0)
 
-    baseline = it_df.groupby(["agency", "agency_code"])["count"].sum().reset_index()
+    baseline = it_df.groupby(["agency", "agency_code"], observed=True)["count"].sum().reset_index()
     baseline.columns = ["agency", "agency_code", "baseline_jan2025"]
     baseline = baseline.sort_values("baseline_jan2025", ascending=False)
 
@@ -65,12 +65,13 @@ def get_monthly_changes(data_type: str) -> pd.DataFrame:
         try:
             df = download_dataset(data_type, month)
             # Filter to 2210 AND only include actions that actually happened in 2025
+            # (astype(str) handles both string and typed integer months)
             it_df = df[(df["occupational_series_code"] == SERIES_CODE) &
-                       (df[date_col].str.startswith("2025"))]
+                       (df[date_col].astype(str).str.startswith("2025"))]
             it_df = it_df.copy()
             it_df["count"] = pd.to_numeric(it_df["count"], errors="coerce").fillna(0)
 
-            monthly = it_df.groupby(["agency", "agency_code"])["count"].sum().reset_index()
+            monthly = it_df.groupby(["agency", "agency_code"], observed=True)["count"].sum().reset_index()
             monthly["month"] = month
             all_data.append(monthly)
         except Exception as e:
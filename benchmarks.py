@@ -0,0 +1,289 @@
+"""
+Benchmarks for the parquet files written by download_and_upload.py.
+
+Run against CSVs already in data/downloads (nothing is uploaded):
+
+    python benchmarks.py layout data/downloads/employment_202501_*.csv
+    python benchmarks.py codecs data/downloads/accessions_2025*.csv
+    python benchmarks.py dropped --rows 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+from fsspec.implementations.local import LocalFileSystem
+
+from download_and_upload import (
+    MAX_MEMORY_MB, ROW_GROUP_SIZE, SORT_KEYS, convert_to_parquet, csv_column_types, csv_read_types,
+    read_csv_header, sort_parquet, sort_table, with_integer_types,
+)
+from subset_agency_data import dropped_counts, summarize_dropped
+
+# Queries from subset_agency_data.py and analyze_2210_workforce.py:
+# name -> (columns to read, None for all; pyarrow filter)
+QUERIES = {
+    "agency subset": (None, [("agency_code", "in", ["AG", "IN"])]),
+    "2210 series": (
+        ["agency", "agency_code", "personnel_action_effective_date_yyyymm", "count"],
+        [("occupational_series_code", "=", "2210")],
+    ),
+}
+
+# (codec, level) pairs for the codec benchmark; None means the codec's default level
+CODECS = [
+    ("zstd", 1), ("zstd", 3), ("zstd", 9), ("zstd", 19),
+    ("snappy", None), ("lz4", None), ("gzip", None),
+]
+
+
+class CountingFile(io.RawIOBase):
+    """Read-only file wrapper that counts the bytes actually read."""
+
+    def __init__(self, path: Path):
+        self.file = open(path, "rb")
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def readinto(self, buffer):
+        n = self.file.readinto(buffer)
+        self.bytes_read += n
+        return n
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class CountingFileSystem(LocalFileSystem):
+    """Local filesystem for DuckDB (via counted://) that counts the bytes it reads."""
+
+    protocol = "counted"
+    bytes_read = 0
+
+    def _open(self, path, mode="rb", **kwargs):
+        f = super()._open(path, mode, **kwargs)
+        read = f.read
+
+        def counting_read(*args):
+            data = read(*args)
+            CountingFileSystem.bytes_read += len(data)
+            return data
+
+        f.read = counting_read
+        return f
+
+
+def filter_to_sql(filters: list[tuple]) -> str:
+    """Turn a simple pyarrow filter list into a DuckDB WHERE clause."""
+    clauses = []
+    for column, op, value in filters:
+        if op == "in":
+            values = ", ".join(f"'{v}'" for v in value)
+            clauses.append(f"{column} IN ({values})")
+        else:
+            clauses.append(f"{column} {op} '{value}'")
+    return " AND ".join(clauses)
+
+
+def run_query(parquet_path: Path, columns: list[str] | None, filters: list[tuple]) -> dict:
+    """Run one query with pyarrow and with DuckDB, counting the bytes each reads."""
+    f = CountingFile(parquet_path)
+    start = time.perf_counter()
+    table = pq.read_table(f, columns=columns, filters=filters)
+    arrow_time = time.perf_counter() - start
+    f.close()
+
+    con = duckdb.connect()
+    con.register_filesystem(CountingFileSystem(skip_instance_cache=True))
+    CountingFileSystem.bytes_read = 0
+    select = ", ".join(columns) if columns else "*"
+    start = time.perf_counter()
+    con.execute(
+        f"SELECT {select} FROM read_parquet('counted://{parquet_path.resolve()}') "
+        f"WHERE {filter_to_sql(filters)}"
+    ).to_arrow_table()
+    duckdb_time = time.perf_counter() - start
+    con.close()
+
+    return {"rows": table.num_rows, "arrow_bytes": f.bytes_read, "arrow_s": arrow_time,
+            "duckdb_bytes": CountingFileSystem.bytes_read, "duckdb_s": duckdb_time}
+
+
+def benchmark_layout(csv_paths: list[Path], sort_keys: list[str], row_group_size: int, schema: str):
+    """Compare bytes read by the agency and 2210 queries before and after sorting."""
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        for csv_path in csv_paths:
+            print(f"\n{csv_path.name}")
+            print(f"  {'layout':<8} {'query':<14} {'file MB':>8} {'rows':>9} "
+                  f"{'arrow MB':>9} {'arrow s':>8} {'duckdb MB':>10} {'duckdb s':>9}")
+
+            default_path = convert_to_parquet(csv_path, tmp_dir, MAX_MEMORY_MB, schema)
+            sorted_path = tmp_dir / f"{csv_path.stem}.sorted-layout.parquet"
+            shutil.copy(default_path, sorted_path)
+            sort_parquet(sorted_path, sort_keys, row_group_size)
+
+            for layout, path in [("default", default_path), ("sorted", sorted_path)]:
+                size = path.stat().st_size
+                for name, (columns, filters) in QUERIES.items():
+                    result = run_query(path, columns, filters)
+                    print(f"  {layout:<8} {name:<14} {size / 1e6:>8.1f} {result['rows']:>9,} "
+                          f"{result['arrow_bytes'] / 1e6:>9.2f} {result['arrow_s']:>8.3f} "
+                          f"{result['duckdb_bytes'] / 1e6:>10.2f} {result['duckdb_s']:>9.3f}")
+
+            default_path.unlink()
+            sorted_path.unlink()
+
+
+def time_call(fn, repeat: int = 3) -> float:
+    """Best-of-N wall time for fn()."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_codecs(csv_paths: list[Path], schema: str, repeat: int):
+    """Compare codecs, dictionary encoding and sorting on size, write and read times."""
+    columns, filters = QUERIES["2210 series"]
+    where = filter_to_sql(filters)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.parquet"
+        for csv_path in csv_paths:
+            column_types = csv_column_types(read_csv_header(csv_path), schema)
+            table = with_integer_types(pv.read_csv(
+                csv_path,
+                parse_options=pv.ParseOptions(delimiter='|'),
+                convert_options=pv.ConvertOptions(
+                    column_types=csv_read_types(column_types),
+                    strings_can_be_null=True,
+                ),
+            ), column_types)
+            csv_mb = csv_path.stat().st_size / 1e6
+            print(f"\n{csv_path.name} ({csv_mb:.1f} MB CSV, {table.num_rows:,} rows, {schema} schema)")
+            print(f"  {'codec':<9} {'level':>5} {'dict':>5} {'sorted':>6} {'MB':>7} {'ratio':>6} "
+                  f"{'write s':>8} {'pd scan':>8} {'pd filt':>8} {'db scan':>8} {'db filt':>8}")
+
+            for is_sorted in (False, True):
+                data = sort_table(table, SORT_KEYS) if is_sorted else table
+                for codec, level in CODECS:
+                    for use_dictionary in (True, False):
+                        write_s = time_call(lambda: pq.write_table(
+                            data, path, compression=codec, compression_level=level,
+                            use_dictionary=use_dictionary,
+                        ), repeat)
+                        size_mb = path.stat().st_size / 1e6
+                        pd_scan = time_call(lambda: pd.read_parquet(path), repeat)
+                        pd_filter = time_call(
+                            lambda: pd.read_parquet(path, columns=columns, filters=filters), repeat
+                        )
+                        db_scan = time_call(
+                            lambda: duckdb.execute(f"SELECT * FROM read_parquet('{path}')").to_arrow_table(),
+                            repeat,
+                        )
+                        db_filter = time_call(
+                            lambda: duckdb.execute(
+                                f"SELECT {', '.join(columns)} FROM read_parquet('{path}') WHERE {where}"
+                            ).to_arrow_table(),
+                            repeat,
+                        )
+                        print(f"  {codec:<9} {level if level is not None else '-':>5} "
+                              f"{'yes' if use_dictionary else 'no':>5} {'yes' if is_sorted else 'no':>6} "
+                              f"{size_mb:>7.2f} {csv_mb / size_mb:>6.1f} {write_s:>8.3f} "
+                              f"{pd_scan:>8.3f} {pd_filter:>8.3f} {db_scan:>8.3f} {db_filter:>8.3f}")
+
+
+def dropped_iterrows(dropped: pd.DataFrame, date_col: str, data_type: str, dropped_tracker: dict):
+    """The per-row dropped-record loop subset_agency_data.py used before dropped_counts()."""
+    dropped["count"] = pd.to_numeric(dropped["count"], errors="coerce").fillna(0)
+    for _, row in dropped.iterrows():
+        key = (row["agency_code"], data_type)
+        if key not in dropped_tracker:
+            dropped_tracker[key] = {"count": 0, "months": set()}
+        dropped_tracker[key]["count"] += int(row["count"])
+        dropped_tracker[key]["months"].add(str(row[date_col]))
+
+
+def benchmark_dropped(rows: int, agencies: int, repeat: int):
+    """Time dropped-record accounting, per-row loop vs vectorized, on a synthetic dropped set."""
+    date_col = "personnel_action_effective_date_yyyymm"
+    rng = np.random.default_rng(0)
+    codes = np.array([f"A{i:02d}" for i in range(agencies)])
+    months = np.array([f"{year}{month:02d}" for year in range(2005, 2015) for month in range(1, 13)])
+    dropped = pa.table({
+        "agency_code": codes[rng.integers(0, agencies, rows)],
+        date_col: months[rng.integers(0, len(months), rows)],
+        "count": rng.integers(1, 4, rows).astype(str),
+    })
+    print(f"\n{rows:,} dropped rows, {agencies} agencies, {len(months)} months")
+
+    tracker = {}
+    loop_s = time_call(lambda: dropped_iterrows(dropped.to_pandas(), date_col, "accessions", tracker), 1)
+    vector_s = time_call(lambda: summarize_dropped([dropped_counts(dropped, date_col, "accessions")]), repeat)
+    summary = summarize_dropped([dropped_counts(dropped, date_col, "accessions")])
+    matches = all(
+        tracker[(row.agency_code, row.data_type)]["count"] == row.count
+        and len(tracker[(row.agency_code, row.data_type)]["months"]) == row.months
+        for row in summary.itertuples()
+    ) and len(summary) == len(tracker)
+    print(f"  iterrows    {loop_s:>8.3f}s")
+    print(f"  vectorized  {vector_s:>8.3f}s  ({loop_s / vector_s:,.0f}x faster, same totals: {matches})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parquet output for OPM data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    layout = subparsers.add_parser("layout", help="Bytes read before/after the sorted layout")
+    layout.add_argument("csv", nargs="+", type=Path, help="OPM CSV files to convert")
+    layout.add_argument("--sort-by", nargs="+", default=SORT_KEYS, metavar="COLUMN")
+    layout.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE)
+    layout.add_argument("--schema", choices=["string", "typed"], default="string")
+
+    codecs = subparsers.add_parser("codecs", help="Size and read/write speed for each codec")
+    codecs.add_argument("csv", nargs="+", type=Path, help="OPM CSV files to sample")
+    codecs.add_argument("--schema", choices=["string", "typed"], default="string")
+    codecs.add_argument("--repeat", type=int, default=3, help="Runs per timing (best is kept)")
+
+    dropped = subparsers.add_parser("dropped", help="Dropped-record accounting in subset_agency_data.py")
+    dropped.add_argument("--rows", type=int, default=1_000_000, help="Synthetic dropped rows")
+    dropped.add_argument("--agencies", type=int, default=20)
+    dropped.add_argument("--repeat", type=int, default=3, help="Runs per vectorized timing (best is kept)")
+
+    args = parser.parse_args()
+    if args.command == "layout":
+        benchmark_layout(args.csv, args.sort_by, args.row_group_size, args.schema)
+    elif args.command == "codecs":
+        benchmark_codecs(args.csv, args.schema, args.repeat)
+    elif args.command == "dropped":
+        benchmark_dropped(args.rows, args.agencies, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,37 @@ Each monthly file becomes its own HF dataset with original OPM naming.
 """
 
 import asyncio
+import hashlib
+import io
 import os
-from pathlib import Path
-import pandas as pd
-from playwright.async_api import async_playwright
-from huggingface_hub import HfApi, create_repo, repo_exists, list_repo_files
+import sys
+import resource
+import shutil
+import sqlite3
 import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+import httpx
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
+from huggingface_hub import CommitOperationAdd, CommitOperationDelete, HfApi
 import argparse
+import json
 import re
 from tqdm import tqdm
 from dotenv import load_dotenv
+from ingest_manifest import (
+    MANIFEST_DB, file_sha256, open_manifest, plan_file,
+    record_conversion, record_download, record_upload, uploaded_file_keys,
+)
+from opm_data import DIMENSIONS, DIMENSIONS_REPO, dimension_table, load_dimensions, update_dimension
+from run_log import RUN_LOG_DIR, RunLog
 
 load_dotenv()
 
@@ -25,6 +46,38 @@ END_DATE = "2025-11-30"
 DATA_TYPES = ["Accessions", "Separations", "Employment"]
 DOWNLOAD_DIR = Path("data/downloads")
 PARQUET_DIR = Path("data/parquet")
+UPLOADED_MANIFEST = Path("data/uploaded_repos.json")
+MAX_MEMORY_MB = 512  # Rough memory budget for CSV -> parquet conversion
+QUEUE_SIZE = 2  # Files buffered between download, convert and upload stages
+COMPRESSION = "zstd"  # Compare codecs with: python benchmarks.py codecs
+COMPRESSION_LEVEL = None  # Codec default
+UPLOAD_BATCH = 8  # Finished files uploaded together (one commit per repo, concurrently)
+HTTP_STREAMS = 4  # Parallel direct downloads in --direct mode
+HTTP_CHUNK_SIZE = 1024 * 1024
+PAGE_TIMEOUT_MS = 5000  # Longest wait for the page to react to a filter or menu change
+DEFAULT_PAGE_SIZE = 10  # Cards per results page until 100 is selected
+
+# Typed parquet schema (--schema typed)
+INTEGER_COLUMNS = {"count"}  # Plus every *_yyyymm column
+DICTIONARY_SUFFIXES = ("_code", "_bracket", "_state")
+
+# Sorted layout (--sort-by)
+SORT_KEYS = ["agency_code", "personnel_action_effective_date_yyyymm", "occupational_series_code"]
+ROW_GROUP_SIZE = 128 * 1024  # Rows per row group when sorting
+
+# Consolidated dataset (--consolidated): every month in one hive-partitioned repo
+CONSOLIDATED_REPO = "opm-federal-workforce"
+PARTITION_FILE_ROWS = 8 * 1024 * 1024  # Rows per file before a month is split (~100 MB typed)
+
+# Rollup tables (--rollups): summed count per month for the dimensions the
+# analyses group by, published next to data.parquet as rollups/<name>.parquet
+ROLLUPS = {
+    "agency_series": ["agency_code", "agency", "occupational_series_code", "occupational_series"],  # 2210 analysis
+    "age_bracket": ["age_bracket"],  # age bracket notebook
+    "state_agency": ["duty_station_state", "agency_code", "agency"],  # state redaction notebook
+    "agency_subelement": ["agency_code", "agency", "agency_subelement_code", "agency_subelement"],  # reconciliation
+}
+ROLLUP_MONTH_COLUMN = "personnel_action_effective_date_yyyymm"  # Added to every rollup's keys
 
 SIZE_ESTIMATES = {
     "Accessions": 6,
@@ -66,15 +119,33 @@ def get_repo_name_from_filename(filename: str) -> str:
     return f"opm-federal-{filename.split('.')[0]}"
 
 
-def is_already_uploaded(repo_id: str, token: str) -> bool:
-    """Check if a dataset already exists on HuggingFace with data."""
-    try:
-        if not repo_exists(repo_id, repo_type="dataset", token=token):
-            return False
-        files = list_repo_files(repo_id, repo_type="dataset", token=token)
-        return "data.parquet" in files
-    except:
-        return False
+def fetch_uploaded_repos(token: str) -> set[str]:
+    """Fetch every dataset under HF_USERNAME that already has data.parquet.
+
+    One paginated listing (with file names expanded) replaces a
+    repo_exists + list_repo_files round trip per card.
+    """
+    api = HfApi()
+    datasets = api.list_datasets(author=HF_USERNAME, search="opm-federal-",
+                                 expand=["siblings"], token=token)
+    return {
+        d.id for d in datasets
+        if any(sibling.rfilename == "data.parquet" for sibling in (d.siblings or []))
+    }
+
+
+def load_uploaded_manifest(manifest_path: Path) -> set[str]:
+    """Load the set of uploaded repo IDs saved by a previous run."""
+    with open(manifest_path) as f:
+        return set(json.load(f)["repos"])
+
+
+def save_uploaded_manifest(repos: set[str], manifest_path: Path):
+    """Save the set of uploaded repo IDs so later runs can work offline."""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump({"saved_at": datetime.now().isoformat(timespec="seconds"),
+                   "repos": sorted(repos)}, f, indent=2)
 
 
 async def get_card_filename(page, card_index: int) -> str:
@@ -88,206 +159,1233 @@ async def get_card_filename(page, card_index: int) -> str:
     return ""
 
 
-async def setup_page(playwright):
-    """Launch browser and navigate to OPM data downloads page."""
-    browser = await playwright.chromium.launch(headless=True)
+# Result count text ("1-100 of 180"), number of cards and first card's label,
+# one per line; any change means the results list has re-rendered
+RESULTS_STATE_JS = """() => {
+    const count = [...document.querySelectorAll('p')]
+        .map(p => p.textContent).find(text => /\\d+-\\d+ of \\d+/.test(text)) || '';
+    const cards = document.querySelectorAll('button[aria-label^="Download options for"]');
+    return [count, cards.length, cards.length ? cards[0].getAttribute('aria-label') : ''].join('\\n');
+}"""
+
+
+async def results_state(page) -> str:
+    """Snapshot of the results list, to compare against after changing filters or pages."""
+    return await page.evaluate(RESULTS_STATE_JS)
+
+
+async def wait_for_results_change(page, previous: str, timeout_ms: int = PAGE_TIMEOUT_MS) -> bool:
+    """Wait until the results list re-renders. False if it never changed (same results).
+
+    The new state only counts once the count text ("1-100 of 180") is back,
+    so a list that is still loading isn't read as 0 results.
+    """
+    try:
+        await page.wait_for_function(
+            f"""previous => {{
+                const state = ({RESULTS_STATE_JS})();
+                return state !== previous && /\\d+-\\d+ of \\d+/.test(state.split('\\n')[0]);
+            }}""",
+            arg=previous, timeout=timeout_ms,
+        )
+        return True
+    except PlaywrightTimeoutError:
+        return False
+
+
+async def setup_page(browser, log: RunLog):
+    """Open a new browser context and navigate to OPM data downloads page.
+
+    Each context keeps its own filter state, so several pages can scrape
+    different data types or date slices at the same time.
+    """
     context = await browser.new_context(accept_downloads=True)
     page = await context.new_page()
 
-    print("🌐 Navigating to OPM data downloads page...")
     await page.goto("https://data.opm.gov/explore-data/data/data-downloads")
     await page.wait_for_load_state("networkidle")
-    await asyncio.sleep(2)
+    await log.wait(page.locator('#data-sources').wait_for(state="visible"), "page load", replaces=2)
 
-    return browser, context, page
+    return context, page
 
 
-async def set_filters(page, data_type: str, start_date: str, end_date: str):
-    """Set the date range and data type filters."""
-    start_input = page.locator('input[aria-label="Select start date"]')
-    await start_input.fill(start_date)
-    await start_input.press('Enter')
-    await asyncio.sleep(1)
+def split_date_range(start_date: str, end_date: str, slices: int) -> list[tuple[str, str]]:
+    """Split a date range into contiguous, month-aligned (start, end) slices."""
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    months = (end.year - start.year) * 12 + end.month - start.month + 1
+    slices = max(1, min(slices, months))
 
-    end_input = page.locator('input[aria-label="Select end date"]')
-    await end_input.fill(end_date)
-    await end_input.press('Enter')
-    await asyncio.sleep(1)
+    def month_start(offset: int) -> date:
+        year, month = divmod(start.month - 1 + offset, 12)
+        return date(start.year + year, month + 1, 1)
 
-    dropdown = page.locator('#data-sources')
-    await dropdown.select_option(data_type)
-    await asyncio.sleep(2)
+    ranges = []
+    for i in range(slices):
+        first = i * months // slices
+        last = (i + 1) * months // slices - 1
+        slice_start = start if i == 0 else month_start(first)
+        slice_end = end if i == slices - 1 else month_start(last + 1) - timedelta(days=1)
+        ranges.append((slice_start.isoformat(), slice_end.isoformat()))
+    return ranges
 
-    try:
-        count_locator = page.locator('p').filter(has_text=re.compile(r'\d+-\d+ of \d+'))
-        count_text = await count_locator.first.text_content()
-        match = re.search(r'of (\d+)', count_text)
-        total = int(match.group(1)) if match else 0
-    except:
-        total = 0
 
-    return total
+def latest_ingested_months(existing: set[str], manifest: sqlite3.Connection) -> dict[str, str]:
+    """Newest YYYYMM already ingested per data type, from the HF listing and the local manifest."""
+    names = [repo_id.split("/")[-1].removeprefix("opm-federal-").replace("-", "_") for repo_id in existing]
+    latest = {}
+    for file_key in names + uploaded_file_keys(manifest):
+        parts = file_key.split("_")
+        if len(parts) == 2 and parts[1].isdigit() and len(parts[1]) == 6:
+            data_type, year_month = parts
+            latest[data_type] = max(latest.get(data_type, year_month), year_month)
+    return latest
 
 
-async def download_file_from_card(page, card_index: int, download_dir: Path) -> Path:
-    """Download a single file by clicking its download button."""
+def month_after(year_month: str) -> str:
+    """First day of the month after YYYYMM, as YYYY-MM-DD."""
+    year, month = divmod(int(year_month[:4]) * 12 + int(year_month[4:]), 12)
+    return date(year, month + 1, 1).isoformat()
+
+
+def build_jobs(data_types: list[str], start_date: str, end_date: str,
+               concurrency: int) -> list[tuple[str, str, str]]:
+    """Build (data_type, start, end) scrape jobs for the page pool.
+
+    With more than one page, each data type is cut into date slices so that
+    idle pages can pick up part of a large type like Employment.
+    """
+    return [
+        (data_type, slice_start, slice_end)
+        for data_type in data_types
+        for slice_start, slice_end in split_date_range(start_date, end_date, max(1, concurrency))
+    ]
+
+
+async def selected_option(select) -> tuple[str, str]:
+    """Value and label of a <select>'s current option."""
+    return await select.evaluate("el => [el.value, el.selectedIndex >= 0 ? el.options[el.selectedIndex].text : '']")
+
+
+async def set_filters(page, data_type: str, start_date: str, end_date: str, log: RunLog):
+    """Set the date range and data type filters.
+
+    page_worker reuses its page across jobs, so filters that already have
+    the wanted value are left alone: changing them wouldn't re-render the
+    results and the wait would run out its whole timeout.
+    """
+    for label, value in [("Select start date", start_date), ("Select end date", end_date)]:
+        date_input = page.locator(f'input[aria-label="{label}"]')
+        if await date_input.input_value() == value:
+            continue
+        state = await results_state(page)
+        await date_input.fill(value)
+        await date_input.press('Enter')
+        await log.wait(wait_for_results_change(page, state), "filters", replaces=1)
+
+    dropdown = page.locator('#data-sources')
+    if data_type not in await selected_option(dropdown):
+        state = await results_state(page)
+        await dropdown.select_option(data_type)
+        await log.wait(wait_for_results_change(page, state), "filters", replaces=2)
+
+    count_text = (await results_state(page)).split("\n")[0]
+    match = re.search(r'of (\d+)', count_text)
+    return int(match.group(1)) if match else 0
+
+
+async def start_card_download(page, card_index: int, log: RunLog):
+    """Click a card's CSV option and return the Playwright download it starts."""
     buttons = page.locator('button[aria-label^="Download options for"]')
     button = buttons.nth(card_index)
 
     await button.click()
-    await asyncio.sleep(0.3)
-
     csv_option = page.get_by_label("CSV", exact=False).first
+    await log.wait(csv_option.wait_for(state="visible", timeout=PAGE_TIMEOUT_MS), "card menu", replaces=0.3)
 
     async with page.expect_download(timeout=600000) as download_info:
         await csv_option.click(force=True)
 
     download = await download_info.value
+
+    await close_card_menu(page, log)
+
+    return download
+
+
+async def close_card_menu(page, log: RunLog, replaces: float = 0.3):
+    """Close an open card menu and wait for it to go away."""
+    await page.keyboard.press('Escape')
+    try:
+        await log.wait(page.get_by_label("CSV", exact=False).first.wait_for(
+            state="hidden", timeout=PAGE_TIMEOUT_MS), "card menu", replaces=replaces)
+    except PlaywrightTimeoutError:
+        pass
+
+
+async def download_file_from_card(page, card_index: int, download_dir: Path, log: RunLog) -> Path:
+    """Download a single file by clicking its download button."""
+    download = await start_card_download(page, card_index, log)
     dest_path = download_dir / download.suggested_filename
     await download.save_as(dest_path)
+    return dest_path
 
-    await page.keyboard.press('Escape')
-    await asyncio.sleep(0.3)
 
+def is_direct_url(url: str) -> bool:
+    """Whether a captured download URL can be fetched outside the browser."""
+    return url.startswith(("http://", "https://"))
+
+
+async def fetch_url(client: httpx.AsyncClient, url: str, dest_path: Path, cookies: dict,
+                    log: RunLog, max_retries: int = 3) -> Path:
+    """Stream a URL to disk, resuming from a partial file after a dropped connection."""
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    for attempt in range(max_retries):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            async with client.stream("GET", url, headers=headers, cookies=cookies) as response:
+                response.raise_for_status()
+                # Server ignored the Range header, so start over
+                mode = "ab" if offset and response.status_code == 206 else "wb"
+                with open(part_path, mode) as f:
+                    async for chunk in response.aiter_bytes(HTTP_CHUNK_SIZE):
+                        f.write(chunk)
+            part_path.rename(dest_path)
+            return dest_path
+        except httpx.HTTPError as e:
+            if attempt < max_retries - 1:
+                log.retry("download", dest_path.stem, e)
+                await log.pause(2 ** (attempt + 1), "retry backoff")  # 2, 4 seconds
+            else:
+                raise
     return dest_path
 
 
-def convert_to_parquet(csv_path: Path, parquet_dir: Path) -> Path:
-    """Convert CSV to parquet format with zstd compression."""
-    # Read with low_memory=False and all columns as strings to avoid type issues
-    df = pd.read_csv(csv_path, delimiter='|', low_memory=False, dtype=str)
-    parquet_name = csv_path.stem + ".parquet"
-    parquet_path = parquet_dir / parquet_name
-    df.to_parquet(parquet_path, compression='zstd', index=False)
-    return parquet_path
+def read_csv_header(csv_path: Path) -> list[str]:
+    """Read the column names from the first line of a pipe-delimited CSV."""
+    with open(csv_path, encoding="utf-8-sig") as f:
+        return f.readline().rstrip("\r\n").split("|")
 
 
-def upload_to_huggingface(parquet_path: Path, repo_id: str, token: str, max_retries: int = 3):
-    """Upload a parquet file to Hugging Face with retry logic."""
-    api = HfApi()
+def reset_peak_rss():
+    """Reset the peak RSS counter so the next reading covers only one file (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
 
-    # Create repo if needed
+def get_peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB."""
     try:
-        create_repo(repo_id, repo_type="dataset", token=token, exist_ok=True)
-    except:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
         pass
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def csv_column_types(columns: list[str], schema: str = "string") -> dict:
+    """Arrow type for each CSV column.
+
+    "string" keeps every column as text (the format already published).
+    "typed" stores count and *_yyyymm columns as integers and dictionary-encodes
+    low-cardinality codes and their labels (agency_code and agency, age_bracket,
+    duty_station_state, ...). Other columns stay strings so codes like "0301"
+    keep their leading zeros.
+    """
+    if schema == "string":
+        return {name: pa.string() for name in columns}
+
+    coded_labels = {name[:-len("_code")] for name in columns if name.endswith("_code")}
+    types = {}
+    for name in columns:
+        if name in INTEGER_COLUMNS or name.endswith("_yyyymm"):
+            types[name] = pa.int32()
+        elif name.endswith(DICTIONARY_SUFFIXES) or name in coded_labels:
+            types[name] = pa.dictionary(pa.int32(), pa.string())
+        else:
+            types[name] = pa.string()
+    return types
+
+
+def numeric_counts(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """An integer column (count, *_yyyymm) as int64, with non-numeric values as null.
+
+    Same result as pd.to_numeric(errors="coerce") for whole numbers; padded
+    values like " 3" are trimmed first.
+    """
+    if pa.types.is_integer(column.type):
+        return column.cast(pa.int64())
+    column = pc.utf8_trim_whitespace(column)
+    return pc.if_else(pc.match_substring_regex(column, r"^-?\d+$"), column, None).cast(pa.int64())
+
+
+def csv_read_types(column_types: dict) -> dict:
+    """Types to parse the CSV with: integer columns are read as text, see with_integer_types."""
+    return {name: pa.string() if pa.types.is_integer(t) else t for name, t in column_types.items()}
+
+
+def with_integer_types(data, column_types: dict):
+    """Convert the integer columns of a batch or table parsed with csv_read_types.
+
+    A stray non-numeric value (e.g. "*") becomes null instead of failing the whole file.
+    """
+    for i, name in enumerate(data.schema.names):
+        if name in column_types and pa.types.is_integer(column_types[name]):
+            data = data.set_column(i, name, numeric_counts(data.column(i)).cast(column_types[name]))
+    return data
+
+
+def write_csv_to_parquet(source, columns: list[str], parquet_path: Path,
+                         max_memory_mb: int = MAX_MEMORY_MB, schema: str = "string") -> Path:
+    """Stream a pipe-delimited CSV (path or file object) into a parquet file.
+
+    The CSV is parsed in fixed-size blocks and each block is written as its
+    own row group, so peak memory depends on max_memory_mb, not file size.
+    See csv_column_types for the "string" and "typed" schemas; in the typed
+    schema, non-numeric counts and months become null.
+    """
+    block_size = max(1, max_memory_mb // 8) * 1024 * 1024  # Arrow buffers a few blocks at once
+    column_types = csv_column_types(columns, schema)
+    reader = pv.open_csv(
+        source,
+        read_options=pv.ReadOptions(block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter='|'),
+        convert_options=pv.ConvertOptions(
+            column_types=csv_read_types(column_types),
+            strings_can_be_null=True,
+        ),
+    )
+    out_schema = pa.schema([(name, column_types.get(name, t)) for name, t in
+                            zip(reader.schema.names, reader.schema.types)])
+
+    with pq.ParquetWriter(parquet_path, out_schema, compression=COMPRESSION,
+                          compression_level=COMPRESSION_LEVEL) as writer:
+        for batch in reader:
+            writer.write_batch(with_integer_types(batch, column_types))
+    return parquet_path
+
+
+def convert_to_parquet(csv_path: Path, parquet_dir: Path, max_memory_mb: int = MAX_MEMORY_MB,
+                       schema: str = "string") -> Path:
+    """Convert a downloaded CSV to parquet with COMPRESSION (zstd by default)."""
+    parquet_path = parquet_dir / (csv_path.stem + ".parquet")
+    return write_csv_to_parquet(csv_path, read_csv_header(csv_path), parquet_path, max_memory_mb, schema)
+
 
-    # Upload with retries
+class HashingStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks.
+
+    Hashes and counts the bytes as they arrive, so a download can be
+    checksummed while it is being parsed, without a copy on disk.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self) -> bool:
+        """Pull the next chunk into the buffer. Returns False at end of stream."""
+        for chunk in self.chunks:
+            if chunk:
+                self.sha256.update(chunk)
+                self.size += len(chunk)
+                self.buffer += chunk
+                return True
+        return False
+
+    def peek_line(self) -> str:
+        """Return the first line (the CSV header) without consuming it."""
+        while b"\n" not in self.buffer and self._fill():
+            pass
+        return self.buffer.split(b"\n", 1)[0].decode("utf-8-sig").rstrip("\r")
+
+    def readinto(self, b):
+        if not self.buffer and not self._fill():
+            return 0
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def sort_table(table: pa.Table, sort_keys: list[str]) -> pa.Table:
+    """Sort a table by whichever of sort_keys it has."""
+    keys = [key for key in sort_keys if key in table.column_names]
+    if not keys:
+        return table
+    # Arrow can't sort dictionary columns directly, so sort on decoded copies
+    key_table = pa.table({
+        key: table[key].cast(table[key].type.value_type)
+        if pa.types.is_dictionary(table[key].type) else table[key]
+        for key in keys
+    })
+    return table.take(pc.sort_indices(key_table, sort_keys=[(key, "ascending") for key in keys]))
+
+
+def sort_parquet(parquet_path: Path, sort_keys: list[str], row_group_size: int = ROW_GROUP_SIZE,
+                 max_memory_mb: int = MAX_MEMORY_MB) -> Path:
+    """Rewrite a parquet file sorted by sort_keys for predicate pushdown.
+
+    Sorted rows give each row group a narrow min/max range on the sort keys,
+    and together with column statistics and the page index this lets DuckDB
+    and pyarrow skip row groups that can't match a filter. DuckDB does the
+    sort within max_memory_mb, spilling to a temp folder next to the file.
+    Its output is then copied one row group at a time into a file with the
+    original schema (dictionary columns stay dictionaries) and sorting
+    metadata, so nothing holds the whole table in memory.
+    """
+    schema = pq.read_schema(parquet_path)
+    keys = [key for key in sort_keys if key in schema.names]
+    spill_dir = parquet_path.with_name(parquet_path.stem + ".sort-tmp")
+    duckdb_path = parquet_path.with_name(parquet_path.stem + ".duckdb-sorted.parquet")
+    sorted_path = parquet_path.with_name(parquet_path.stem + ".sorted.parquet")
+
+    con = duckdb.connect()
+    try:
+        con.execute("SET enable_progress_bar = false")
+        con.execute(f"SET memory_limit = '{max_memory_mb}MB'")
+        con.execute(f"SET temp_directory = '{spill_dir}'")
+        order_by = "ORDER BY " + ", ".join(f'"{key}"' for key in keys) if keys else ""
+        con.execute(f"""
+            COPY (SELECT * FROM read_parquet('{parquet_path}') {order_by})
+            TO '{duckdb_path}' (FORMAT parquet, COMPRESSION uncompressed, ROW_GROUP_SIZE {row_group_size})
+        """)
+    finally:
+        con.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    try:
+        source = pq.ParquetFile(duckdb_path)
+        with pq.ParquetWriter(
+            sorted_path, schema,
+            compression=COMPRESSION,
+            compression_level=COMPRESSION_LEVEL,
+            write_statistics=True,
+            write_page_index=True,
+            sorting_columns=pq.SortingColumn.from_ordering(
+                schema, [(key, "ascending") for key in keys]
+            ) if keys else None,
+        ) as writer:
+            for i in range(source.num_row_groups):
+                writer.write_table(source.read_row_group(i).cast(schema), row_group_size=row_group_size)
+    finally:
+        duckdb_path.unlink(missing_ok=True)
+    sorted_path.replace(parquet_path)
+    return parquet_path
+
+
+def partition_path(filename: str) -> str:
+    """Hive partition of an OPM file in the consolidated dataset.
+
+    Example: accessions_202511_1_2026-01-09 -> data_type=accessions/year=2025/month=11
+    """
+    data_type, year_month = Path(filename).stem.split("_")[:2]
+    return f"data_type={data_type}/year={year_month[:4]}/month={year_month[4:]}"
+
+
+def write_partition(parquet_path: Path, partition_dir: Path, row_group_size: int = ROW_GROUP_SIZE,
+                    max_rows_per_file: int = PARTITION_FILE_ROWS) -> list[Path]:
+    """Rewrite one month's parquet as consolidated-dataset files.
+
+    Every file gets the typed schema (see csv_column_types) whatever schema
+    the per-month repo uses, so all months of a data type share one schema.
+    Data types have different columns, so a glob across them needs
+    union_by_name. Row groups are row_group_size rows, and a month only
+    splits into several files past max_rows_per_file, so each partition is
+    a few well-sized files rather than many small ones.
+    """
+    source = pq.ParquetFile(parquet_path)
+    column_types = csv_column_types(source.schema_arrow.names, "typed")
+    schema = pa.schema(list(column_types.items()))
+    partition_dir.mkdir(parents=True, exist_ok=True)
+
+    paths, writer, rows_in_file = [], None, 0
+    try:
+        for batch in source.iter_batches(batch_size=row_group_size):
+            if writer is None or rows_in_file >= max_rows_per_file:
+                if writer:
+                    writer.close()
+                paths.append(partition_dir / f"part-{len(paths)}.parquet")
+                writer = pq.ParquetWriter(paths[-1], schema, compression=COMPRESSION,
+                                          compression_level=COMPRESSION_LEVEL)
+                rows_in_file = 0
+            # Counts and months from string-schema files are converted leniently, as in the CSV reader
+            table = with_integer_types(pa.Table.from_batches([batch]), column_types).cast(schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            rows_in_file += batch.num_rows
+        if writer is None:  # Empty month: still publish the partition with its schema
+            paths.append(partition_dir / "part-0.parquet")
+            pq.write_table(schema.empty_table(), paths[-1], compression=COMPRESSION)
+    finally:
+        if writer:
+            writer.close()
+    return paths
+
+
+def write_rollups(parquet_path: Path, rollup_dir: Path, rollups: dict[str, list[str]] = ROLLUPS) -> dict[str, Path]:
+    """Write a small parquet per rollup with summed count and row count per group.
+
+    Row groups are aggregated one at a time and the partial sums combined at
+    the end, so memory depends on the number of groups, not the file size.
+    Returns path_in_repo -> local path.
+    """
+    source = pq.ParquetFile(parquet_path)
+    available = set(source.schema_arrow.names)
+    rollups = {name: [ROLLUP_MONTH_COLUMN] + [c for c in keys if c in available]
+               for name, keys in rollups.items()}
+    columns = sorted({c for keys in rollups.values() for c in keys} & available | {"count"})
+
+    partials = {name: [] for name in rollups}
+    for batch in source.iter_batches(columns=columns):
+        table = pa.Table.from_batches([batch])
+        # Plain strings, so partials with different dictionaries can be combined
+        table = table.cast(pa.schema([
+            pa.field(f.name, f.type.value_type if pa.types.is_dictionary(f.type) else f.type)
+            for f in table.schema
+        ]))
+        table = table.set_column(table.schema.get_field_index("count"), "count", numeric_counts(table["count"]))
+        for name, keys in rollups.items():
+            partials[name].append(
+                table.group_by(keys).aggregate([("count", "sum"), ([], "count_all")])
+                .rename_columns(keys + ["count", "records"])
+            )
+
+    rollup_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for name, keys in rollups.items():
+        combined = pa.concat_tables(partials[name]) if partials[name] else None
+        if combined is None:
+            continue
+        table = (combined.group_by(keys).aggregate([("count", "sum"), ("records", "sum")])
+                 .rename_columns(keys + ["count", "records"]))
+        table = table.sort_by([(key, "ascending") for key in keys])
+        path = rollup_dir / f"{name}.parquet"
+        pq.write_table(table, path, compression=COMPRESSION, compression_level=COMPRESSION_LEVEL)
+        files[f"rollups/{name}.parquet"] = path
+    return files
+
+
+def merge_ranges(ranges: list[list[int]]) -> list[list[int]]:
+    """Merge touching [start, end) row ranges: [[0, 10], [10, 20]] -> [[0, 20]]."""
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def write_stats(parquet_path: Path, stats_path: Path) -> Path:
+    """Write a JSON sidecar describing one month without anyone needing the data.
+
+    Holds the row count, summed count, distinct and null counts per column,
+    the min/max effective month, and for each agency code its row count and
+    the row groups (as [start, end) row ranges) that contain it. On files
+    sorted by agency_code (--sort-by) each agency is a single range.
+    """
+    source = pq.ParquetFile(parquet_path)
+    names = source.schema_arrow.names
+    distinct = {name: set() for name in names}
+    nulls = dict.fromkeys(names, 0)
+    agencies = {}
+    count_sum = 0
+    months = []
+    row_start = 0
+
+    for i in range(source.num_row_groups):
+        table = source.read_row_group(i)
+        for name in names:
+            column = table[name]
+            if pa.types.is_dictionary(column.type):
+                column = column.cast(column.type.value_type)
+            distinct[name].update(pc.unique(column).drop_null().to_pylist())
+            nulls[name] += column.null_count
+        if "count" in names:
+            count_sum += pc.sum(numeric_counts(table["count"])).as_py() or 0
+        if ROLLUP_MONTH_COLUMN in names:
+            month_range = pc.min_max(numeric_counts(table[ROLLUP_MONTH_COLUMN]))
+            months += [m for m in (month_range["min"].as_py(), month_range["max"].as_py()) if m is not None]
+        if "agency_code" in names:
+            codes = table["agency_code"].cast(pa.string()) if pa.types.is_dictionary(table["agency_code"].type) \
+                else table["agency_code"]
+            row_end = row_start + table.num_rows
+            for row in pc.value_counts(codes.drop_null()).to_pylist():
+                agency = agencies.setdefault(row["values"], {"rows": 0, "row_groups": [], "row_ranges": []})
+                agency["rows"] += row["counts"]
+                agency["row_groups"].append(i)
+                agency["row_ranges"].append([row_start, row_end])
+        row_start += table.num_rows
+
+    for agency in agencies.values():
+        agency["row_ranges"] = merge_ranges(agency["row_ranges"])
+    stats = {
+        "file": parquet_path.stem,
+        "row_count": source.metadata.num_rows,
+        "row_groups": source.num_row_groups,
+        "count_sum": count_sum,
+        "date_min": min(months) if months else None,
+        "date_max": max(months) if months else None,
+        "columns": {name: {"type": str(source.schema_arrow.field(name).type),
+                           "distinct": len(distinct[name]), "nulls": nulls[name]} for name in names},
+        "agencies": dict(sorted(agencies.items())),
+    }
+    stats_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(stats_path, "w") as f:
+        json.dump(stats, f, indent=1)
+    return stats_path
+
+
+def write_normalized(parquet_path: Path, normalized_path: Path) -> tuple[Path, dict[str, list[tuple]]]:
+    """Write a month without its label columns, for --normalized.
+
+    A first pass over just the code and label columns finds the distinct
+    (code, label) pairs per dimension (see opm_data.DIMENSIONS). A label
+    column is only dropped if every code has one label in this month, so
+    normalizing never loses information. Returns the new file and the pairs
+    of each dropped label, to merge into the shared tables.
+    """
+    source = pq.ParquetFile(parquet_path)
+    names = source.schema_arrow.names
+    dimensions = {name: (code, label) for name, (code, label) in DIMENSIONS.items()
+                  if code in names and label in names}
+
+    pairs = {name: set() for name in dimensions}
+    for batch in source.iter_batches(columns=sorted({c for pair in dimensions.values() for c in pair})):
+        table = pa.Table.from_batches([batch])
+        for name, (code, label) in dimensions.items():
+            distinct = table.select([code, label]).cast(pa.schema([(code, pa.string()), (label, pa.string())]))
+            distinct = distinct.group_by([code, label]).aggregate([])
+            pairs[name].update(zip(distinct[code].to_pylist(), distinct[label].to_pylist()))
+
+    pairs = {name: sorted(p for p in found if p[0] is not None) for name, found in pairs.items()}
+    normalized = {name: found for name, found in pairs.items()
+                  if len({code for code, _ in found}) == len(found)}
+    labels = {dimensions[name][1] for name in normalized}
+    schema = pa.schema([f for f in source.schema_arrow if f.name not in labels])
+
+    normalized_path.parent.mkdir(parents=True, exist_ok=True)
+    with pq.ParquetWriter(normalized_path, schema, compression=COMPRESSION,
+                          compression_level=COMPRESSION_LEVEL) as writer:
+        for i in range(source.num_row_groups):
+            writer.write_table(source.read_row_group(i, columns=schema.names))
+    return normalized_path, normalized
+
+
+def commit_to_huggingface(api: HfApi, repo_id: str, files: dict[str, Path], token: str,
+                          create: bool = True, replace_dirs: list[str] = ()) -> str | None:
+    """Push every file for one dataset repo in a single commit. Returns the commit ID.
+
+    files maps path_in_repo -> local path. create=False skips the
+    create_repo call for repos we already know exist. replace_dirs are
+    folders whose contents the commit replaces: files already in them that
+    aren't in files are deleted in the same commit.
+    """
+    if create:
+        api.create_repo(repo_id, repo_type="dataset", token=token, exist_ok=True)
+    operations = [
+        CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=str(local_path))
+        for path_in_repo, local_path in files.items()
+    ]
+    if replace_dirs:
+        prefixes = tuple(f"{folder.rstrip('/')}/" for folder in replace_dirs)
+        operations += [
+            CommitOperationDelete(path_in_repo=path)
+            for path in api.list_repo_files(repo_id, repo_type="dataset", token=token)
+            if path.startswith(prefixes) and path not in files
+        ]
+    commit = api.create_commit(
+        repo_id, operations,
+        commit_message=f"Upload {', '.join(files)}",
+        repo_type="dataset",
+        token=token,
+    )
+    return commit.oid
+
+
+@dataclass
+class IngestRun:
+    """Shared state for one run of the download -> convert -> upload pipeline."""
+    download_dir: Path
+    parquet_dir: Path
+    token: str | None
+    existing: set[str]
+    manifest: sqlite3.Connection
+    pbar: tqdm
+    max_memory_mb: int = MAX_MEMORY_MB
+    schema: str = "string"
+    sort_keys: list[str] | None = None
+    row_group_size: int = ROW_GROUP_SIZE
+    dry_run: bool = False
+    keep_csv: bool = False
+    keep_parquet: bool = False  # Leave data.parquet in parquet_dir for opm_data.resolve_file
+    http_client: httpx.AsyncClient | None = None  # Set in --direct mode
+    stream: bool = False  # --stream: parse downloads straight into parquet
+    upload_batch: int = UPLOAD_BATCH
+    since_last: bool = False
+    consolidated_repo: str | None = None  # Also publish to this hive-partitioned repo
+    rollups: bool = False  # Publish rollups/*.parquet next to each data.parquet
+    stats: bool = False  # Publish a stats.json sidecar next to each data.parquet
+    normalized: bool = False  # Publish normalized.parquet and keep the dimension tables up to date
+    dimensions: dict = field(default_factory=dict)  # Dimension name -> (code, label) -> [first, last month]
+    log: RunLog = field(default_factory=lambda: RunLog(None))  # Stage timings (see run_log.py)
+    hf_api: HfApi = field(default_factory=HfApi)  # One HTTP session shared by all uploads
+    convert_pool: ProcessPoolExecutor | None = None  # Set by run_pipeline
+    http_streams: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(HTTP_STREAMS))
+    fetch_tasks: list = field(default_factory=list)
+    convert_queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=QUEUE_SIZE))
+    upload_queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=QUEUE_SIZE))
+    uploaded_repos: list = field(default_factory=list)
+    failed_files: list = field(default_factory=list)
+
+    def fail(self, filename: str | None, error: Exception, stage: str = ""):
+        """Report a failed file and remember it for the end-of-run summary."""
+        error_msg = str(error)[:60]
+        self.pbar.write(f"  ⚠️ {stage + ' error' if stage else 'Error'}: {error_msg}")
+        if filename:
+            self.failed_files.append({"filename": filename, "error": error_msg})
+
+    def record_conversion(self, stage: str, card_filename: str, result: dict):
+        """Log a finished conversion (or streamed download) with its throughput."""
+        parquet_bytes = result["parquet_path"].stat().st_size
+        self.log.record(
+            stage, card_filename, result["seconds"],
+            bytes=result["csv_size"], parquet_bytes=parquet_bytes, rows=result["row_count"],
+            rows_per_s=round(result["row_count"] / result["seconds"]) if result["seconds"] else None,
+            ratio=round(result["csv_size"] / parquet_bytes, 1) if parquet_bytes else None,
+            peak_rss_mb=round(result["peak_rss_mb"]),
+        )
+
+
+def conversion_result(parquet_path: Path, csv_size: int, csv_sha256: str, seconds: float) -> dict:
+    """Stats reported back from a conversion worker."""
+    return {
+        "parquet_path": parquet_path,
+        "seconds": seconds,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "row_count": pq.ParquetFile(parquet_path).metadata.num_rows,
+        "csv_size": csv_size,
+        "csv_sha256": csv_sha256,
+        "parquet_sha256": file_sha256(parquet_path),
+    }
+
+
+def convert_file(csv_path: Path, parquet_dir: Path, max_memory_mb: int = MAX_MEMORY_MB,
+                 schema: str = "string", sort_keys: list[str] | None = None,
+                 row_group_size: int = ROW_GROUP_SIZE) -> dict:
+    """Convert one CSV in a worker process and report checksums, row count and peak RSS."""
+    reset_peak_rss()
+    start = time.perf_counter()
+    parquet_path = convert_to_parquet(csv_path, parquet_dir, max_memory_mb, schema)
+    if sort_keys:
+        sort_parquet(parquet_path, sort_keys, row_group_size, max_memory_mb)
+    seconds = time.perf_counter() - start
+    return conversion_result(parquet_path, csv_path.stat().st_size, file_sha256(csv_path), seconds)
+
+
+_http_client = None  # One pooled client per worker process, created on first use
+
+
+def stream_file(url: str, cookies: dict, parquet_path: Path, max_memory_mb: int = MAX_MEMORY_MB,
+                schema: str = "string", sort_keys: list[str] | None = None,
+                row_group_size: int = ROW_GROUP_SIZE) -> dict:
+    """Download a CSV over HTTP straight into the parquet writer, in a worker process.
+
+    The CSV never touches disk: bytes go from the response into the CSV
+    parser and are hashed on the way through.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(timeout=httpx.Timeout(60, read=600), follow_redirects=True)
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        with _http_client.stream("GET", url, cookies=cookies) as response:
+            response.raise_for_status()
+            stream = HashingStream(response.iter_bytes(HTTP_CHUNK_SIZE))
+            columns = stream.peek_line().split("|")
+            write_csv_to_parquet(stream, columns, parquet_path, max_memory_mb, schema)
+    except httpx.HTTPError as e:
+        # httpx errors can't be pickled back to the parent process
+        parquet_path.unlink(missing_ok=True)
+        raise RuntimeError(str(e)) from None
+    except Exception:
+        parquet_path.unlink(missing_ok=True)
+        raise
+    if sort_keys:
+        sort_parquet(parquet_path, sort_keys, row_group_size, max_memory_mb)
+    seconds = time.perf_counter() - start
+    return conversion_result(parquet_path, stream.size, stream.sha256.hexdigest(), seconds)
+
+
+async def fetch_stage(run: IngestRun, card_filename: str, url: str, dest_path: Path, cookies: dict):
+    """Fetch one captured download URL over HTTP and hand it to the convert stage.
+
+    The stream slot is held until the convert queue accepts the file, so at
+    most run.http_streams finished CSVs wait on disk when conversion lags.
+    """
+    async with run.http_streams:
+        try:
+            start = time.perf_counter()
+            csv_path = await fetch_url(run.http_client, url, dest_path, cookies, run.log)
+            run.log.record("download", card_filename, time.perf_counter() - start,
+                           bytes=csv_path.stat().st_size, via="http")
+            record_download(run.manifest, card_filename, csv_path.stat().st_size,
+                            f"{HF_USERNAME}/{get_repo_name_from_filename(csv_path.name)}")
+        except Exception as e:
+            run.fail(card_filename, e, "Fetch")
+            run.pbar.update(1)
+            return
+        await run.convert_queue.put((card_filename, csv_path))
+
+
+async def stream_stage(run: IngestRun, card_filename: str, url: str, cookies: dict):
+    """Stream one captured download URL straight into parquet and hand it to the upload stage.
+
+    As in fetch_stage, the stream slot is held until the upload queue takes the file.
+    """
+    async with run.http_streams:
+        loop = asyncio.get_running_loop()
+        parquet_path = run.parquet_dir / f"{card_filename}.parquet"
+        try:
+            result = await loop.run_in_executor(
+                run.convert_pool, stream_file, url, cookies, parquet_path, run.max_memory_mb,
+                run.schema, run.sort_keys, run.row_group_size
+            )
+        except Exception as e:
+            run.fail(card_filename, e, "Stream")
+            run.pbar.update(1)
+            return
+
+        run.record_conversion("stream", card_filename, result)
+        record_download(run.manifest, card_filename, result["csv_size"],
+                        f"{HF_USERNAME}/{get_repo_name_from_filename(card_filename)}")
+        record_conversion(run.manifest, card_filename, result["csv_sha256"],
+                          parquet_path, result["parquet_sha256"], result["row_count"])
+        run.pbar.set_postfix({
+            "repo": get_repo_name_from_filename(card_filename)[-25:],
+            "size": f"{result['csv_size'] / (1024 * 1024):.0f}→"
+                    f"{parquet_path.stat().st_size / (1024 * 1024):.1f}MB",
+            "rss": f"{result['peak_rss_mb']:.0f}MB",
+        })
+        await run.upload_queue.put((card_filename, run.download_dir / f"{card_filename}.csv", parquet_path))
+
+
+async def convert_stage(run: IngestRun, convert_pool):
+    """Pull downloaded CSVs off the queue and convert them in the process pool."""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await run.convert_queue.get()
+        if item is None:
+            return
+
+        card_filename, csv_path = item
+        try:
+            result = await loop.run_in_executor(
+                convert_pool, convert_file, csv_path, run.parquet_dir, run.max_memory_mb,
+                run.schema, run.sort_keys, run.row_group_size
+            )
+        except Exception as e:
+            run.fail(card_filename, e, "Convert")
+            run.pbar.update(1)
+            continue
+
+        parquet_path = result["parquet_path"]
+        run.record_conversion("convert", card_filename, result)
+        record_conversion(run.manifest, card_filename, result["csv_sha256"],
+                          parquet_path, result["parquet_sha256"], result["row_count"])
+
+        csv_size = csv_path.stat().st_size / (1024 * 1024)
+        parquet_size = parquet_path.stat().st_size / (1024 * 1024)
+        run.pbar.set_postfix({
+            "repo": get_repo_name_from_filename(csv_path.name)[-25:],
+            "size": f"{csv_size:.0f}→{parquet_size:.1f}MB",
+            "rss": f"{result['peak_rss_mb']:.0f}MB",
+        })
+        await run.upload_queue.put((card_filename, csv_path, parquet_path))
+
+
+async def upload_files(run: IngestRun, upload_pool, repo_id: str, files: dict[str, Path],
+                       max_retries: int = 3, replace_dirs: list[str] = ()) -> str | None:
+    """Commit files to a repo from the thread pool, backing off without blocking the event loop."""
+    loop = asyncio.get_running_loop()
     for attempt in range(max_retries):
         try:
-            api.upload_file(
-                path_or_fileobj=str(parquet_path),
-                path_in_repo="data.parquet",
-                repo_id=repo_id,
-                repo_type="dataset",
-                token=token,
+            return await loop.run_in_executor(
+                upload_pool, commit_to_huggingface, run.hf_api, repo_id, files, run.token,
+                repo_id not in run.existing, replace_dirs
             )
-            return repo_id
         except Exception as e:
             if attempt < max_retries - 1:
-                wait_time = 2 ** (attempt + 1)  # 2, 4, 8 seconds
-                time.sleep(wait_time)
+                run.log.retry("upload", repo_id, e)
+                await run.log.pause(2 ** (attempt + 1), "retry backoff")  # 2, 4 seconds
             else:
-                raise e
-    return repo_id
+                raise
 
 
-async def download_and_upload_all(page, data_type: str, download_dir: Path, parquet_dir: Path,
-                                   start_date: str, end_date: str, token: str):
-    """Download all files for a data type, uploading each immediately."""
-    print(f"\n{'='*60}")
-    print(f"📥 {data_type.upper()}")
-    print(f"{'='*60}")
+async def upload_one(run: IngestRun, upload_pool, card_filename: str, csv_path: Path, parquet_path: Path):
+    """Upload one converted month, record it and clean up its local files."""
+    repo_id = f"{HF_USERNAME}/{get_repo_name_from_filename(parquet_path.name)}"
+    files = {"data.parquet": parquet_path}
+    loop = asyncio.get_running_loop()
+    try:
+        if run.rollups:
+            files.update(await loop.run_in_executor(
+                run.convert_pool, write_rollups, parquet_path, run.parquet_dir / "rollups" / card_filename
+            ))
+        if run.stats:
+            files["stats.json"] = await loop.run_in_executor(
+                run.convert_pool, write_stats, parquet_path, run.parquet_dir / "stats" / f"{card_filename}.json"
+            )
+        if run.normalized:
+            files["normalized.parquet"], pairs = await loop.run_in_executor(
+                run.convert_pool, write_normalized, parquet_path,
+                run.parquet_dir / "normalized" / f"{card_filename}.parquet"
+            )
+            month = int(card_filename.split("_")[1])
+            for name, found in pairs.items():
+                update_dimension(run.dimensions.setdefault(name, {}), found, month)
+
+        start = time.perf_counter()
+        commit_id = await upload_files(run, upload_pool, repo_id, files)
+        run.log.record("upload", card_filename, time.perf_counter() - start,
+                       bytes=sum(path.stat().st_size for path in files.values()), repo_id=repo_id)
+        record_upload(run.manifest, card_filename, commit_id)
+        run.uploaded_repos.append(repo_id)
+
+        # Cleanup (CSVs from --from-dir are an archive, so keep them)
+        if not run.keep_csv:
+            csv_path.unlink(missing_ok=True)
+        for path in files.values():
+            if not (run.keep_parquet and path == parquet_path):
+                path.unlink()
+    except Exception as e:
+        run.fail(card_filename, e, "Upload")
+    run.pbar.update(1)
+
+
+async def write_partitions(run: IngestRun, batch: list[tuple]) -> dict[str, Path]:
+    """Write consolidated-dataset files for a batch of months in the process pool.
+
+    Returns path_in_repo -> local path for every file written.
+    """
+    loop = asyncio.get_running_loop()
+    files = {}
+    for card_filename, _, parquet_path in batch:
+        partition = partition_path(card_filename)
+        try:
+            paths = await loop.run_in_executor(
+                run.convert_pool, write_partition, parquet_path,
+                run.parquet_dir / "partitions" / partition, run.row_group_size
+            )
+        except Exception as e:
+            run.fail(card_filename, e, "Partition")
+            continue
+        files.update({f"data/{partition}/{path.name}": path for path in paths})
+    return files
+
 
-    total = await set_filters(page, data_type, start_date, end_date)
+async def upload_partitions(run: IngestRun, upload_pool, files: dict[str, Path]):
+    """Push a batch's consolidated-dataset files in one commit, then delete them locally.
+
+    Each partition in the batch is replaced as a whole, so parts left over
+    from an earlier version of a month (which had more part-N files) are
+    deleted in the same commit rather than counted twice.
+    """
+    if not files:
+        return
+    repo_id = f"{HF_USERNAME}/{run.consolidated_repo}"
+    partitions = sorted({path_in_repo.rsplit("/", 1)[0] for path_in_repo in files})
+    try:
+        start = time.perf_counter()
+        await upload_files(run, upload_pool, repo_id, files, replace_dirs=partitions)
+        run.log.record("upload", repo_id, time.perf_counter() - start,
+                       bytes=sum(path.stat().st_size for path in files.values()), repo_id=repo_id)
+    except Exception as e:
+        # The months themselves are recorded as uploaded, so re-publish them with --from-dir
+        run.fail(", ".join(partitions), e, "Consolidated upload")
+    finally:
+        for path in files.values():
+            path.unlink(missing_ok=True)
+
+
+async def upload_dimensions(run: IngestRun, upload_pool):
+    """Push the merged dimension tables after a batch of normalized months."""
+    repo_id = DIMENSIONS_REPO
+    dimension_dir = run.parquet_dir / "dimensions"
+    dimension_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for name, rows in run.dimensions.items():
+        files[f"{name}.parquet"] = dimension_dir / f"{name}.parquet"
+        pq.write_table(dimension_table(name, rows), files[f"{name}.parquet"], compression=COMPRESSION)
+    try:
+        start = time.perf_counter()
+        await upload_files(run, upload_pool, repo_id, files)
+        run.log.record("upload", repo_id, time.perf_counter() - start,
+                       bytes=sum(path.stat().st_size for path in files.values()), repo_id=repo_id)
+    except Exception as e:
+        # Retried with the next batch or run, since run.dimensions keeps every pair
+        run.fail(None, e, "Dimension upload")
+
+
+async def upload_stage(run: IngestRun, upload_pool):
+    """Pull converted parquet files off the queue and upload them in batches.
+
+    Whatever has finished converting (up to run.upload_batch files) is
+    uploaded together, one commit per repo, with the commits running
+    concurrently in the thread pool over one shared HfApi session. With a
+    consolidated repo, the batch's partitions are written first (before the
+    per-month files are cleaned up) and pushed as one more commit. With
+    normalized output, the updated dimension tables follow each batch.
+    """
+    finished = False
+    while not finished:
+        item = await run.upload_queue.get()
+        if item is None:
+            return
+
+        batch = [item]
+        while len(batch) < run.upload_batch and not run.upload_queue.empty():
+            item = run.upload_queue.get_nowait()
+            if item is None:
+                finished = True
+                break
+            batch.append(item)
+
+        uploads = [upload_one(run, upload_pool, *item) for item in batch]
+        if run.consolidated_repo:
+            uploads.append(upload_partitions(run, upload_pool, await write_partitions(run, batch)))
+        await asyncio.gather(*uploads)
+        if run.normalized and run.dimensions:
+            await upload_dimensions(run, upload_pool)
+
+
+async def download_cards(page, run: IngestRun, data_type: str, start_date: str, end_date: str):
+    """Download every card matching the filters on one page into the convert queue.
+
+    The local manifest decides what each card still needs: finished files
+    are skipped, files left on disk by an interrupted run are resumed at
+    the right stage, and files whose upstream version changed are fetched
+    again. Cards the manifest has never seen are skipped if their repo is
+    already on HuggingFace. With dry_run, planned work is only reported.
+    """
+    job_name = f"{data_type} {start_date} → {end_date}"
+    start = time.perf_counter()
+    total = await set_filters(page, data_type, start_date, end_date, run.log)
     if total == 0:
-        print("  No files found, skipping...")
-        return [], []
+        run.log.record("navigate", job_name, time.perf_counter() - start, files=0)
+        run.pbar.write(f"  {data_type} {start_date} → {end_date}: no files found, skipping...")
+        return
 
-    print(f"  Found {total} files")
+    run.pbar.write(f"  📥 {data_type} {start_date} → {end_date}: found {total} files")
+    run.pbar.total = (run.pbar.total or 0) + total
+    run.pbar.refresh()
 
-    # Set to 100 items per page
+    # Set to 100 items per page (nothing re-renders if it already is, or if everything fits on one page)
     try:
         rows_dropdown = page.locator('select').filter(has_text='10')
-        await rows_dropdown.select_option('100')
-        await asyncio.sleep(2)
+        if total > DEFAULT_PAGE_SIZE and "100" not in await selected_option(rows_dropdown):
+            state = await results_state(page)
+            await rows_dropdown.select_option('100')
+            await run.log.wait(wait_for_results_change(page, state), "pagination", replaces=2)
     except:
         pass
-
-    uploaded_repos = []
-    failed_files = []
-    pbar = tqdm(total=total, desc=f"  {data_type}", unit="file")
+    run.log.record("navigate", job_name, time.perf_counter() - start, files=total, page=1)
 
     page_num = 1
     while True:
         buttons = page.locator('button[aria-label^="Download options for"]')
         count = await buttons.count()
+        skipped_on_page = 0
 
         for i in range(count):
             card_filename = None
             try:
-                # Check if already uploaded before downloading
+                # Check local manifest and HF listing before downloading
                 card_filename = await get_card_filename(page, i)
+                action = "new"
                 if card_filename:
                     repo_name = get_repo_name_from_filename(card_filename)
                     repo_id = f"{HF_USERNAME}/{repo_name}"
-                    if is_already_uploaded(repo_id, token):
-                        pbar.set_postfix({"status": "skipped (exists)"})
-                        pbar.update(1)
-                        uploaded_repos.append(repo_id)
+                    action = plan_file(run.manifest, card_filename, run.download_dir, run.parquet_dir)
+                    if action == "done" or (action == "new" and repo_id in run.existing):
+                        run.pbar.set_postfix({"status": "skipped (exists)"})
+                        run.pbar.update(1)
+                        run.uploaded_repos.append(repo_id)
+                        skipped_on_page += 1
                         continue
 
-                # Download
-                csv_path = await download_file_from_card(page, i, download_dir)
-                csv_size = csv_path.stat().st_size / (1024 * 1024)
-
-                # Convert
-                parquet_path = convert_to_parquet(csv_path, parquet_dir)
-                parquet_size = parquet_path.stat().st_size / (1024 * 1024)
-
-                # Get repo name from filename
-                repo_name = get_repo_name_from_filename(csv_path.name)
-                repo_id = f"{HF_USERNAME}/{repo_name}"
-
-                pbar.set_postfix({
-                    "repo": repo_name[-25:],
-                    "size": f"{csv_size:.0f}→{parquet_size:.1f}MB"
-                })
-
-                # Upload (now with retries built-in)
-                upload_to_huggingface(parquet_path, repo_id, token)
-                uploaded_repos.append(repo_id)
-
-                # Cleanup
-                csv_path.unlink()
-                parquet_path.unlink()
-
-                pbar.update(1)
-                await asyncio.sleep(0.3)
+                if run.dry_run:
+                    run.pbar.write(f"  Would process {card_filename} ({action})")
+                    run.pbar.update(1)
+                    continue
+
+                # Resume files an earlier run left on disk
+                if action == "upload":
+                    await run.upload_queue.put((card_filename,
+                                                run.download_dir / f"{card_filename}.csv",
+                                                run.parquet_dir / f"{card_filename}.parquet"))
+                    continue
+                if action == "convert":
+                    await run.convert_queue.put((card_filename, run.download_dir / f"{card_filename}.csv"))
+                    continue
+
+                # Direct mode: the browser only discovers the URL, HTTP streams fetch it
+                start = time.perf_counter()
+                if run.http_client:
+                    download = await start_card_download(page, i, run.log)
+                    card_filename = card_filename or Path(download.suggested_filename).stem
+                    if is_direct_url(download.url):
+                        await download.cancel()
+                        cookies = {c["name"]: c["value"] for c in await page.context.cookies()}
+                        if run.stream:
+                            fetch = stream_stage(run, card_filename, download.url, cookies)
+                        else:
+                            dest_path = run.download_dir / download.suggested_filename
+                            fetch = fetch_stage(run, card_filename, download.url, dest_path, cookies)
+                        run.fetch_tasks.append(asyncio.create_task(fetch))
+                        continue
+                    csv_path = run.download_dir / download.suggested_filename
+                    await download.save_as(csv_path)
+                else:
+                    # Download, then hand off to the convert stage (waits if it is backed up)
+                    csv_path = await download_file_from_card(page, i, run.download_dir, run.log)
+                card_filename = card_filename or csv_path.stem
+                run.log.record("download", card_filename, time.perf_counter() - start,
+                               bytes=csv_path.stat().st_size, via="browser")
+                record_download(run.manifest, card_filename, csv_path.stat().st_size,
+                                f"{HF_USERNAME}/{get_repo_name_from_filename(csv_path.name)}")
+                await run.convert_queue.put((card_filename, csv_path))
 
             except Exception as e:
-                error_msg = str(e)[:60]
-                pbar.write(f"  ⚠️ Error: {error_msg}")
-                if card_filename:
-                    failed_files.append({"filename": card_filename, "error": error_msg})
-                await page.keyboard.press('Escape')
-                await asyncio.sleep(0.5)
-                pbar.update(1)
+                run.fail(card_filename, e)
+                await close_card_menu(page, run.log, replaces=0.5)
+                run.pbar.update(1)
                 continue
 
+        # In --since-last mode a page of nothing but known months means we've caught up
+        if run.since_last and count and skipped_on_page == count:
+            run.pbar.write(f"  {data_type}: reached months already ingested, stopping early")
+            break
+
         next_button = page.locator('button[aria-label="Go to next page"]')
         if await next_button.is_disabled():
             break
 
+        start = time.perf_counter()
+        state = await results_state(page)
         await next_button.click()
-        await asyncio.sleep(2)
+        await run.log.wait(wait_for_results_change(page, state), "pagination", replaces=2)
         page_num += 1
+        run.log.record("navigate", job_name, time.perf_counter() - start, page=page_num)
 
-    pbar.close()
-    print(f"  ✅ Uploaded {len(uploaded_repos)} datasets")
-    if failed_files:
-        print(f"  ❌ Failed {len(failed_files)} files")
-    return uploaded_repos, failed_files
+
+async def page_worker(browser, jobs: asyncio.Queue, run: IngestRun):
+    """Work through scrape jobs on a dedicated browser page until none are left."""
+    start = time.perf_counter()
+    context, page = await setup_page(browser, run.log)
+    run.log.record("navigate", "open page", time.perf_counter() - start)
+    try:
+        while True:
+            try:
+                data_type, start_date, end_date = jobs.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await download_cards(page, run, data_type, start_date, end_date)
+            except Exception as e:
+                run.fail(f"{data_type} {start_date} → {end_date}", e)
+    finally:
+        await context.close()
+
+
+async def convert_directory(run: IngestRun, csv_dir: Path, data_types: list[str],
+                            start_date: str, end_date: str):
+    """Queue OPM CSVs from a local folder for conversion, without opening a browser."""
+    wanted_types = {data_type.lower() for data_type in data_types}
+    first_month = start_date[:7].replace("-", "")
+    last_month = end_date[:7].replace("-", "")
+
+    for csv_path in sorted(csv_dir.glob("*.csv")):
+        parts = csv_path.stem.split("_")
+        if len(parts) < 2 or parts[0] not in wanted_types or not first_month <= parts[1] <= last_month:
+            continue
+
+        run.pbar.total += 1
+        run.pbar.refresh()
+        if run.dry_run:
+            run.pbar.write(f"  Would convert {csv_path.name}")
+            run.pbar.update(1)
+            continue
+
+        record_download(run.manifest, csv_path.stem, csv_path.stat().st_size,
+                        f"{HF_USERNAME}/{get_repo_name_from_filename(csv_path.name)}")
+        await run.convert_queue.put((csv_path.stem, csv_path))
+
+
+async def run_pipeline(run: IngestRun, producer, convert_pool, upload_pool, convert_workers: int = 1):
+    """Run a producer of CSVs through the convert and upload stages until everything drains.
+
+    The producer (browser pages or a local folder) fills the convert queue;
+    convert_workers tasks convert in the process pool and the upload task
+    pushes batches of finished files from the thread pool, all joined by
+    bounded queues.
+    """
+    run.convert_pool = convert_pool
+    converters = [asyncio.create_task(convert_stage(run, convert_pool)) for _ in range(convert_workers)]
+    uploader = asyncio.create_task(upload_stage(run, upload_pool))
+
+    try:
+        await producer
+    finally:
+        # Let direct fetches, then the convert and upload stages, drain before returning
+        await asyncio.gather(*run.fetch_tasks)
+        for _ in converters:
+            await run.convert_queue.put(None)
+        await asyncio.gather(*converters)
+        await run.upload_queue.put(None)
+        await uploader
+
+    run.pbar.close()
+    print(f"  ✅ Uploaded {len(run.uploaded_repos)} datasets")
+    if run.failed_files:
+        print(f"  ❌ Failed {len(run.failed_files)} files")
+    return run.uploaded_repos, run.failed_files
+
+
+async def download_and_upload_all(browser, jobs: list[tuple[str, str, str]], run: IngestRun,
+                                   convert_pool, upload_pool, concurrency: int = 1,
+                                   convert_workers: int = 1):
+    """Download all files for the given jobs, converting and uploading them as they arrive.
+
+    A pool of browser pages pulls (data_type, start, end) jobs and feeds
+    downloads into the convert and upload stages, so the browsers keep
+    fetching while earlier files are still being converted or uploaded.
+    """
+    job_queue = asyncio.Queue()
+    for job in jobs:
+        job_queue.put_nowait(job)
+
+    print(f"\n🌐 Opening {min(concurrency, len(jobs))} page(s) on the OPM data downloads page...")
+    pages = asyncio.gather(*[
+        page_worker(browser, job_queue, run)
+        for _ in range(min(concurrency, len(jobs)))
+    ])
+    return await run_pipeline(run, pages, convert_pool, upload_pool, convert_workers)
 
 
 async def main():
@@ -296,9 +1394,62 @@ async def main():
     parser.add_argument("--start", default=START_DATE, help="Start date (YYYY-MM-DD)")
     parser.add_argument("--end", default=END_DATE, help="End date (YYYY-MM-DD)")
     parser.add_argument("--types", nargs="+", default=DATA_TYPES, help="Data types to download")
+    parser.add_argument("--max-memory", type=int, default=MAX_MEMORY_MB,
+                        help="Approximate memory budget in MB for CSV -> parquet conversion")
+    parser.add_argument("--schema", choices=["string", "typed"], default="string",
+                        help="Parquet column types: all strings, or integer counts/months and "
+                             "dictionary-encoded codes")
+    parser.add_argument("--sort-by", nargs="*", default=None, metavar="COLUMN",
+                        help=f"Sort each file for predicate pushdown (no columns = {' '.join(SORT_KEYS)})")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE,
+                        help="Rows per row group for sorted files")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Number of browser pages scraping in parallel")
+    parser.add_argument("--convert-workers", type=int, default=1,
+                        help="Number of processes converting CSVs in parallel")
+    parser.add_argument("--from-dir", type=Path, default=None,
+                        help="Convert and upload CSVs already in this folder instead of scraping")
+    parser.add_argument("--manifest", type=Path, default=UPLOADED_MANIFEST,
+                        help="Local list of already-uploaded repos (written every run)")
+    parser.add_argument("--direct", action="store_true",
+                        help="Use the browser only to find download URLs, then fetch them over HTTP")
+    parser.add_argument("--stream", action="store_true",
+                        help="Like --direct, but parse each download straight into parquet "
+                             "without saving the CSV")
+    parser.add_argument("--http-streams", type=int, default=HTTP_STREAMS,
+                        help="Parallel HTTP downloads in --direct mode")
+    parser.add_argument("--upload-batch", type=int, default=UPLOAD_BATCH,
+                        help="Upload up to this many finished files at once, in parallel")
+    parser.add_argument("--ingest-db", type=Path, default=MANIFEST_DB,
+                        help="Local SQLite manifest of processed files, checksums and versions")
+    parser.add_argument("--offline", action="store_true",
+                        help="Read already-uploaded repos from --manifest instead of the Hub")
+    parser.add_argument("--log-dir", type=Path, default=RUN_LOG_DIR,
+                        help="Folder for the JSON-lines log of per-file stage timings")
+    parser.add_argument("--since-last", action="store_true",
+                        help="Only look for months newer than the latest one already ingested "
+                             "(re-published older months are not re-checked)")
+    parser.add_argument("--consolidated", nargs="?", const=CONSOLIDATED_REPO, default=None,
+                        metavar="REPO",
+                        help="Also publish every month to one dataset partitioned by "
+                             f"data_type=/year=/month= (default repo: {CONSOLIDATED_REPO})")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Also publish small per-month rollups (summed count by agency x series, "
+                             "age bracket, state x agency, agency x subelement)")
+    parser.add_argument("--stats", action="store_true",
+                        help="Also publish a stats.json sidecar per month (row count, summed count, "
+                             "distinct counts, date range, agency row ranges)")
+    parser.add_argument("--normalized", action="store_true",
+                        help="Also publish normalized.parquet per month (codes only) and keep the "
+                             f"shared label tables in {DIMENSIONS_REPO} up to date")
+    parser.add_argument("--keep-parquet", action="store_true",
+                        help="Keep each uploaded data.parquet in data/parquet, where the analysis "
+                             "scripts read it instead of downloading it again")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="List files that would be downloaded without downloading or uploading")
     args = parser.parse_args()
 
-    if not args.token:
+    if not args.token and not args.dry_run:
         print("❌ Error: HF_TOKEN environment variable or --token required")
         return
 
@@ -319,23 +1470,88 @@ async def main():
         est_parquet = est_csv * 0.04
         print(f"  {dtype}: {months} datasets, ~{est_parquet:.0f} MB total parquet")
 
-    all_repos = []
-    all_failures = []
+    if args.offline and not args.manifest.exists():
+        print(f"❌ Error: --offline needs a manifest from a previous run at {args.manifest}")
+        return
 
-    async with async_playwright() as playwright:
-        browser, context, page = await setup_page(playwright)
+    if args.offline:
+        existing = load_uploaded_manifest(args.manifest)
+        print(f"\n📋 Loaded {len(existing)} uploaded datasets from {args.manifest}")
+    else:
+        existing = fetch_uploaded_repos(args.token)
+        save_uploaded_manifest(existing, args.manifest)
+        print(f"\n📋 Found {len(existing)} uploaded datasets on HuggingFace")
+
+    manifest = open_manifest(args.ingest_db)
+    latest = latest_ingested_months(existing, manifest) if args.since_last else {}
+    run = IngestRun(
+        download_dir=DOWNLOAD_DIR,
+        parquet_dir=PARQUET_DIR,
+        token=args.token,
+        existing=existing,
+        manifest=manifest,
+        pbar=tqdm(total=0, desc="  Files", unit="file"),
+        max_memory_mb=args.max_memory,
+        schema=args.schema,
+        sort_keys=(args.sort_by or SORT_KEYS) if args.sort_by is not None else None,
+        row_group_size=args.row_group_size,
+        dry_run=args.dry_run,
+        stream=args.stream,
+        upload_batch=args.upload_batch,
+        since_last=args.since_last,
+        consolidated_repo=args.consolidated,
+        rollups=args.rollups,
+        stats=args.stats,
+        normalized=args.normalized,
+        dimensions=load_dimensions(token=args.token) if args.normalized and not args.dry_run else {},
+        upload_queue=asyncio.Queue(maxsize=max(QUEUE_SIZE, args.upload_batch)),
+        keep_csv=args.from_dir is not None,
+        keep_parquet=args.keep_parquet,
+        http_streams=asyncio.Semaphore(args.http_streams),
+        log=RunLog(args.log_dir),
+    )
 
-        try:
-            for data_type in args.types:
-                repos, failures = await download_and_upload_all(
-                    page, data_type, DOWNLOAD_DIR, PARQUET_DIR,
-                    args.start, args.end, args.token
-                )
-                all_repos.extend(repos)
-                all_failures.extend(failures)
-
-        finally:
-            await browser.close()
+    try:
+        with ProcessPoolExecutor(max_workers=args.convert_workers) as convert_pool, \
+                ThreadPoolExecutor(max_workers=args.upload_batch) as upload_pool:
+            if args.from_dir:
+                print(f"\n📂 Converting CSVs from {args.from_dir}")
+                producer = convert_directory(run, args.from_dir, args.types, args.start, args.end)
+                await run_pipeline(run, producer, convert_pool, upload_pool, args.convert_workers)
+            else:
+                jobs = []
+                for data_type in args.types:
+                    start_date = args.start
+                    newest = latest.get(data_type.lower())
+                    if newest:
+                        start_date = max(start_date, month_after(newest))
+                    if start_date > args.end:
+                        print(f"  {data_type}: nothing to sync (latest ingested {newest})")
+                        continue
+                    jobs += build_jobs([data_type], start_date, args.end, args.concurrency)
+                async with async_playwright() as playwright, httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=args.http_streams),
+                    timeout=httpx.Timeout(60, read=600),
+                    follow_redirects=True,
+                ) as http_client:
+                    if args.direct or args.stream:
+                        run.http_client = http_client
+                    browser = await playwright.chromium.launch(headless=True)
+                    try:
+                        await download_and_upload_all(browser, jobs, run, convert_pool, upload_pool,
+                                                      args.concurrency, args.convert_workers)
+                    finally:
+                        await browser.close()
+    finally:
+        manifest.close()
+        print("\n⏱️ Stage timings:")
+        print(run.log.summary())
+        run.log.close()
+
+    all_repos, all_failures = run.uploaded_repos, run.failed_files
+
+    if not args.dry_run:
+        save_uploaded_manifest(existing | set(all_repos), args.manifest)
 
     print("\n" + "="*60)
     print("🎉 DONE!")
@@ -0,0 +1,214 @@
+"""
+Store Employment snapshots as keyframes plus month-to-month deltas.
+
+Each Employment file is a full workforce snapshot and consecutive months
+are mostly the same rows. This keeps a full keyframe every N months and,
+in between, only the aggregate rows whose count changed, appeared or
+disappeared since the previous month:
+
+    data/employment_deltas/
+        months.parquet            one row per month: keyframe or delta, base month
+        keyframes/202501.parquet  dimension columns, count, records
+        deltas/202502.parquet     same columns, signed changes vs the month before
+
+Rows are aggregated by every dimension column (as text), so a rebuilt month
+has one row per distinct combination with its summed count and number of
+source records. When a month has a single effective date, it is stored once
+in months.parquet instead of on every row, so it doesn't make every row
+differ from the month before.
+opm_data.employment_month() rebuilds any month from its keyframe and deltas;
+month-over-month questions can read deltas/<month>.parquet directly. Every
+month except the first stored one has a delta, keyframe months included
+(there it is only for reading; rebuilds start from the keyframe).
+
+    python employment_deltas.py build data/parquet/employment_2025*.parquet
+    python employment_deltas.py build --from-hub 202401 202511
+    python employment_deltas.py upload
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from huggingface_hub import HfApi
+from tqdm import tqdm
+
+from opm_data import DELTA_MONTHS_FILE, employment_month, resolve_file
+
+load_dotenv()
+
+HF_USERNAME = "abigailhaddad"
+DELTA_DIR = Path("data/employment_deltas")
+DELTA_REPO = "opm-federal-employment-deltas"
+KEYFRAME_EVERY = 6  # Months between full keyframes
+DATE_COLUMN = "personnel_action_effective_date_yyyymm"
+MEASURE = "count"
+
+MONTHS_SCHEMA = pa.schema([
+    ("year_month", pa.int32()), ("kind", pa.string()), ("base_month", pa.int32()),
+    ("effective_yyyymm", pa.int32()), ("groups", pa.int64()), ("bytes", pa.int64()), ("source", pa.string()),
+])
+
+
+def month_of(path: Path) -> int:
+    """YYYYMM from an OPM filename like employment_202511_1_2026-01-09.parquet."""
+    match = re.search(r"_(\d{6})(?:_|\.)", path.name)
+    if not match:
+        raise ValueError(f"No YYYYMM in {path.name}")
+    return int(match.group(1))
+
+
+def months_between(first: int, last: int) -> int:
+    """Number of months from YYYYMM first to YYYYMM last."""
+    return (last // 100 - first // 100) * 12 + last % 100 - first % 100
+
+
+def load_snapshot(con: duckdb.DuckDBPyConnection, path: Path, name: str) -> int | None:
+    """Aggregate one month into table name as (dimensions..., count, records).
+
+    If every row has the same effective date, the date column is left null
+    and the date is returned instead, for months.parquet.
+    """
+    source = f"read_parquet('{path}')"
+    dates = con.sql(f"SELECT DISTINCT {DATE_COLUMN}::VARCHAR FROM {source}").fetchall()
+    effective = int(dates[0][0]) if len(dates) == 1 and dates[0][0] is not None else None
+
+    select = [
+        (f"NULL::VARCHAR" if c == DATE_COLUMN and effective is not None else f'"{c}"::VARCHAR') + f' AS "{c}"'
+        for c in pq.ParquetFile(path).schema_arrow.names if c != MEASURE
+    ]
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {name} AS
+        SELECT {', '.join(select)},
+               sum(TRY_CAST("{MEASURE}" AS BIGINT))::BIGINT AS count, count(*)::BIGINT AS records
+        FROM {source} GROUP BY ALL
+    """)
+    return effective
+
+
+def write_delta(con: duckdb.DuckDBPyConnection, current: str, previous: str, path: Path):
+    """Write the signed per-group changes from previous to current (unchanged groups omitted)."""
+    con.execute(f"""
+        COPY (
+            SELECT * EXCLUDE (count, records), sum(count)::BIGINT AS count, sum(records)::BIGINT AS records
+            FROM (
+                SELECT * FROM {current}
+                UNION ALL BY NAME
+                SELECT * REPLACE (-count AS count, -records AS records) FROM {previous}
+            )
+            GROUP BY ALL
+            HAVING sum(records) != 0 OR coalesce(sum(count), 0) != 0
+        ) TO '{path}' (FORMAT parquet, COMPRESSION zstd)
+    """)
+
+
+def build(sources: dict[int, Path], out_dir: Path, keyframe_every: int = KEYFRAME_EVERY):
+    """Add months (YYYYMM -> parquet path) to the store, after the months already in it.
+
+    Months are processed in order. A month becomes a keyframe if it is the
+    first one, or keyframe_every months have passed since the last keyframe.
+    """
+    (out_dir / "keyframes").mkdir(parents=True, exist_ok=True)
+    (out_dir / "deltas").mkdir(parents=True, exist_ok=True)
+    months_path = out_dir / DELTA_MONTHS_FILE
+    con = duckdb.connect()
+
+    months = pq.read_table(months_path).to_pylist() if months_path.exists() else []
+    last = months[-1]["year_month"] if months else None
+    keyframe = max((m["year_month"] for m in months if m["kind"] == "keyframe"), default=None)
+
+    if last is not None:
+        # Previous snapshot, rebuilt from the store, to diff the first new month against
+        con.execute("CREATE TEMP TABLE previous AS " + employment_month(str(out_dir), last, con).sql_query())
+        if months[-1]["effective_yyyymm"] is not None:
+            con.execute(f"UPDATE previous SET {DATE_COLUMN} = NULL")  # Back to the stored form
+
+    for month, path in tqdm(sorted(sources.items()), desc="Months"):
+        if last is not None and month <= last:
+            print(f"  Skipping {path.name}: {month} is already stored")
+            continue
+
+        effective = load_snapshot(con, path, "current")
+        if keyframe is None or months_between(keyframe, month) >= keyframe_every:
+            out_path = out_dir / "keyframes" / f"{month}.parquet"
+            con.execute(f"COPY current TO '{out_path}' (FORMAT parquet, COMPRESSION zstd)")
+            if last is not None:
+                # Not needed to rebuild the month, but keeps month-over-month changes a direct read
+                write_delta(con, "current", "previous", out_dir / "deltas" / f"{month}.parquet")
+            kind, base, keyframe = "keyframe", None, month
+        else:
+            out_path = out_dir / "deltas" / f"{month}.parquet"
+            write_delta(con, "current", "previous", out_path)
+            kind, base = "delta", last
+
+        groups = con.sql("SELECT count(*) FROM current").fetchone()[0]
+        months.append({"year_month": month, "kind": kind, "base_month": base, "effective_yyyymm": effective,
+                       "groups": groups, "bytes": out_path.stat().st_size, "source": path.name})
+        con.execute("CREATE OR REPLACE TEMP TABLE previous AS SELECT * FROM current")
+        last = month
+
+    pq.write_table(pa.Table.from_pylist(months, schema=MONTHS_SCHEMA), months_path)
+
+    keyframe_mb = sum(m["bytes"] for m in months if m["kind"] == "keyframe") / 1e6
+    delta_mb = sum(m["bytes"] for m in months if m["kind"] == "delta") / 1e6
+    print(f"\n  {len(months)} months: {keyframe_mb:.1f} MB of keyframes, {delta_mb:.1f} MB of deltas")
+
+
+def download_months(first: int, last: int) -> dict[int, Path]:
+    """Fetch the published Employment months in [first, last] (local copies first, see resolve_file)."""
+    paths = {}
+    year, month = divmod(first, 100)
+    while year * 100 + month <= last:
+        repo_id = f"{HF_USERNAME}/opm-federal-employment-{year}{month:02d}"
+        try:
+            paths[year * 100 + month] = resolve_file(repo_id)
+        except Exception as e:
+            print(f"  Skipping {repo_id}: {str(e)[:60]}")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return paths
+
+
+def upload(out_dir: Path, token: str):
+    """Publish the store as one dataset repo in a single commit."""
+    repo_id = f"{HF_USERNAME}/{DELTA_REPO}"
+    api = HfApi()
+    api.create_repo(repo_id, repo_type="dataset", token=token, exist_ok=True)
+    commit = api.upload_folder(repo_id=repo_id, folder_path=out_dir, repo_type="dataset", token=token,
+                               commit_message="Update Employment keyframes and deltas")
+    print(f"  Uploaded to https://huggingface.co/datasets/{repo_id} ({commit.oid[:8]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyframe + delta storage for Employment snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Add Employment months to the store")
+    build_parser.add_argument("parquet", nargs="*", type=Path, help="Employment parquet files")
+    build_parser.add_argument("--from-hub", nargs=2, type=int, metavar=("FIRST", "LAST"),
+                              help="Use the published months FIRST..LAST (YYYYMM) instead of local files")
+    build_parser.add_argument("--out", type=Path, default=DELTA_DIR)
+    build_parser.add_argument("--keyframe-every", type=int, default=KEYFRAME_EVERY)
+
+    upload_parser = subparsers.add_parser("upload", help=f"Publish the store to {DELTA_REPO}")
+    upload_parser.add_argument("--out", type=Path, default=DELTA_DIR)
+    upload_parser.add_argument("--token", default=os.environ.get("HF_TOKEN"))
+
+    args = parser.parse_args()
+    if args.command == "build":
+        sources = download_months(*args.from_hub) if args.from_hub else {month_of(p): p for p in args.parquet}
+        build(sources, args.out, args.keyframe_every)
+    elif args.command == "upload":
+        upload(args.out, args.token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Local SQLite manifest of ingested OPM files.
+
+Records, per OPM file, which upstream version was processed, checksums and
+sizes of the CSV and parquet, the upload commit, and when each stage
+finished. download_and_upload.py uses it to skip finished work, resume
+partial work and re-process files whose upstream version changed, without
+asking HuggingFace.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_DB = Path("data/ingest_manifest.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_key TEXT PRIMARY KEY,      -- accessions_202511
+    filename TEXT NOT NULL,         -- accessions_202511_1_2026-01-09
+    source_version TEXT NOT NULL,   -- 1_2026-01-09
+    repo_id TEXT,
+    csv_size INTEGER,
+    csv_sha256 TEXT,
+    parquet_size INTEGER,
+    parquet_sha256 TEXT,
+    row_count INTEGER,
+    commit_id TEXT,
+    downloaded_at TEXT,
+    converted_at TEXT,
+    uploaded_at TEXT
+)
+"""
+
+
+def parse_opm_filename(filename: str) -> tuple[str, str]:
+    """Split an OPM filename into its file key and source version.
+
+    Example: accessions_202511_1_2026-01-09.csv -> ("accessions_202511", "1_2026-01-09")
+    """
+    stem = filename.replace('.csv', '').replace('.parquet', '')
+    parts = stem.split('_', 2)
+    if len(parts) < 3:
+        return stem, ""
+    return f"{parts[0]}_{parts[1]}", parts[2]
+
+
+def file_sha256(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_manifest(db_path: Path = MANIFEST_DB) -> sqlite3.Connection:
+    """Open (and create if needed) the manifest database."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute(SCHEMA)
+    conn.commit()
+    return conn
+
+
+def get_entry(conn: sqlite3.Connection, filename: str) -> dict | None:
+    """Look up the manifest entry for an OPM file (any version)."""
+    file_key, _ = parse_opm_filename(filename)
+    row = conn.execute("SELECT * FROM files WHERE file_key = ?", (file_key,)).fetchone()
+    return dict(row) if row else None
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def record_download(conn: sqlite3.Connection, filename: str, csv_size: int, repo_id: str):
+    """Record a finished download. A new source version resets all later stages."""
+    file_key, version = parse_opm_filename(filename)
+    conn.execute(
+        """
+        INSERT INTO files (file_key, filename, source_version, repo_id, csv_size, downloaded_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(file_key) DO UPDATE SET
+            filename = excluded.filename,
+            source_version = excluded.source_version,
+            repo_id = excluded.repo_id,
+            csv_size = excluded.csv_size,
+            csv_sha256 = NULL,
+            parquet_size = NULL,
+            parquet_sha256 = NULL,
+            row_count = NULL,
+            commit_id = NULL,
+            downloaded_at = excluded.downloaded_at,
+            converted_at = NULL,
+            uploaded_at = NULL
+        """,
+        (file_key, filename, version, repo_id, csv_size, _now()),
+    )
+    conn.commit()
+
+
+def record_conversion(conn: sqlite3.Connection, filename: str, csv_sha256: str,
+                      parquet_path: Path, parquet_sha256: str, row_count: int):
+    """Record a finished CSV -> parquet conversion."""
+    file_key, _ = parse_opm_filename(filename)
+    conn.execute(
+        """
+        UPDATE files SET csv_sha256 = ?, parquet_size = ?, parquet_sha256 = ?,
+                         row_count = ?, converted_at = ?
+        WHERE file_key = ?
+        """,
+        (csv_sha256, parquet_path.stat().st_size, parquet_sha256, row_count, _now(), file_key),
+    )
+    conn.commit()
+
+
+def record_upload(conn: sqlite3.Connection, filename: str, commit_id: str | None):
+    """Record a finished upload and its HuggingFace commit."""
+    file_key, _ = parse_opm_filename(filename)
+    conn.execute(
+        "UPDATE files SET commit_id = ?, uploaded_at = ? WHERE file_key = ?",
+        (commit_id, _now(), file_key),
+    )
+    conn.commit()
+
+
+def plan_file(conn: sqlite3.Connection, filename: str, download_dir: Path, parquet_dir: Path) -> str:
+    """Decide what still needs doing for an OPM file, using only local state.
+
+    Returns one of:
+      "new"      - never seen before
+      "changed"  - seen, but upstream published a different version
+      "done"     - this version is already uploaded
+      "upload"   - converted parquet is on disk and matches the manifest
+      "convert"  - downloaded CSV is on disk and matches the manifest
+      "download" - seen, but nothing usable is left on disk
+    """
+    entry = get_entry(conn, filename)
+    if entry is None:
+        return "new"
+
+    _, version = parse_opm_filename(filename)
+    if entry["source_version"] != version:
+        return "changed"
+    if entry["uploaded_at"]:
+        return "done"
+
+    parquet_path = parquet_dir / f"{entry['filename']}.parquet"
+    if (entry["converted_at"] and parquet_path.exists()
+            and parquet_path.stat().st_size == entry["parquet_size"]
+            and file_sha256(parquet_path) == entry["parquet_sha256"]):
+        return "upload"
+
+    csv_path = download_dir / f"{entry['filename']}.csv"
+    if entry["downloaded_at"] and csv_path.exists() and csv_path.stat().st_size == entry["csv_size"]:
+        return "convert"
+
+    return "download"
+
+
+def uploaded_file_keys(conn: sqlite3.Connection) -> list[str]:
+    """File keys (e.g. accessions_202511) of every file whose upload finished."""
+    rows = conn.execute("SELECT file_key FROM files WHERE uploaded_at IS NOT NULL").fetchall()
+    return [row["file_key"] for row in rows]
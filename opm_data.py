@@ -0,0 +1,221 @@
+"""
+Read OPM data published by download_and_upload.py.
+
+Months published with --normalized carry normalized.parquet next to
+data.parquet. It holds the same rows without the long label columns (agency,
+agency_subelement, occupational_series), which live once in shared dimension
+tables in the opm-federal-dimensions dataset. Labels can change over time, so
+each dimension row is one (code, label) version with the first and last file
+month it was seen in. A month where some code has more than one label keeps
+that label column in normalized.parquet instead.
+
+load_month() joins the labels back lazily with DuckDB:
+
+    from opm_data import load_month
+    rel = load_month("employment", 202511)
+    rel.filter("agency_code = 'AG'").df()  # Nothing is read until here
+
+resolve_file() is how scripts and notebooks get a month's files on disk. It
+uses download_and_upload.py's own output and the HuggingFace cache before
+going to the network, so a machine that ran the pipeline doesn't download
+what it just uploaded.
+"""
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from huggingface_hub import hf_hub_download, try_to_load_from_cache
+from huggingface_hub.errors import EntryNotFoundError, RepositoryNotFoundError
+
+from ingest_manifest import MANIFEST_DB, file_sha256, get_entry, open_manifest
+
+HF_USERNAME = "abigailhaddad"
+DIMENSIONS_REPO = f"{HF_USERNAME}/opm-federal-dimensions"
+LOCAL_PARQUET_DIR = Path("data/parquet")  # download_and_upload.py output (kept with --keep-parquet)
+
+# Employment keyframe + delta store (see employment_deltas.py)
+EMPLOYMENT_DELTAS = f"hf://datasets/{HF_USERNAME}/opm-federal-employment-deltas"
+DELTA_MONTHS_FILE = "months.parquet"
+DELTA_DATE_COLUMN = "personnel_action_effective_date_yyyymm"
+
+# Dimension table name -> (code column, label column)
+DIMENSIONS = {
+    "agency": ("agency_code", "agency"),
+    "agency_subelement": ("agency_subelement_code", "agency_subelement"),
+    "occupational_series": ("occupational_series_code", "occupational_series"),
+}
+
+
+def dataset_file_url(repo_id: str, filename: str) -> str:
+    """hf:// path DuckDB can read a published file from."""
+    return f"hf://datasets/{repo_id}/{filename}"
+
+
+def normalized_url(data_type: str, year_month: int | str) -> str:
+    """Path to a month's normalized fact file."""
+    return dataset_file_url(f"{HF_USERNAME}/opm-federal-{data_type.lower()}-{year_month}", "normalized.parquet")
+
+
+def manifest_entry(repo_id: str, manifest_db: Path = MANIFEST_DB) -> dict | None:
+    """The ingest manifest entry for a per-month repo, if this machine ingested it."""
+    match = re.search(r"opm-federal-([a-z]+)-(\d{6})$", repo_id)
+    if not match or not manifest_db.exists():
+        return None
+    conn = open_manifest(manifest_db)
+    try:
+        return get_entry(conn, f"{match.group(1)}_{match.group(2)}")
+    finally:
+        conn.close()
+
+
+def resolve_file(repo_id: str, filename: str = "data.parquet", parquet_dir: Path = LOCAL_PARQUET_DIR,
+                 manifest_db: Path = MANIFEST_DB, token: str | None = None) -> Path:
+    """Local path to a file from a per-month repo, downloading it only if there is no fresh copy.
+
+    Tries, in order:
+      1. download_and_upload.py's parquet in parquet_dir (data.parquet only),
+         if its size and checksum match the ingest manifest
+      2. the HuggingFace cache at the commit the manifest recorded for the upload
+      3. the network (hf_hub_download, which checks the cache against the Hub)
+    Without a manifest entry, there is nothing to check a local copy against,
+    so it goes straight to step 3.
+    """
+    entry = manifest_entry(repo_id, manifest_db)
+    if entry:
+        local = parquet_dir / f"{entry['filename']}.parquet"
+        if (filename == "data.parquet" and entry["converted_at"] and local.exists()
+                and local.stat().st_size == entry["parquet_size"]
+                and file_sha256(local) == entry["parquet_sha256"]):
+            return local
+        if entry["commit_id"]:
+            cached = try_to_load_from_cache(repo_id, filename, revision=entry["commit_id"], repo_type="dataset")
+            if isinstance(cached, str):
+                return Path(cached)
+    return Path(hf_hub_download(repo_id=repo_id, filename=filename, repo_type="dataset", token=token))
+
+
+def dimension_urls(repo_id: str = DIMENSIONS_REPO) -> dict[str, str]:
+    """Paths to the shared dimension tables."""
+    return {name: dataset_file_url(repo_id, f"{name}.parquet") for name in DIMENSIONS}
+
+
+def dimension_schema(name: str) -> pa.Schema:
+    code, label = DIMENSIONS[name]
+    return pa.schema([(code, pa.string()), (label, pa.string()),
+                      ("first_month", pa.int32()), ("last_month", pa.int32())])
+
+
+def dimension_rows(table: pa.Table) -> dict[tuple[str, str], list[int]]:
+    """(code, label) -> [first_month, last_month] from a dimension table."""
+    code, label, first, last = table.column_names
+    return {
+        (row[code], row[label]): [row[first], row[last]]
+        for row in table.to_pylist()
+    }
+
+
+def update_dimension(rows: dict[tuple[str, str], list[int]], pairs: list[tuple[str, str]], month: int):
+    """Record that each (code, label) pair appears in the file for month."""
+    for pair in pairs:
+        months = rows.setdefault(pair, [month, month])
+        months[0] = min(months[0], month)
+        months[1] = max(months[1], month)
+
+
+def dimension_table(name: str, rows: dict[tuple[str, str], list[int]]) -> pa.Table:
+    """Dimension table sorted by code, then first month."""
+    records = sorted((code, label, first, last) for (code, label), (first, last) in rows.items())
+    schema = dimension_schema(name)
+    return pa.table([list(column) for column in zip(*records)] if records else [[]] * 4, schema=schema)
+
+
+def load_dimensions(repo_id: str = DIMENSIONS_REPO, token: str | None = None) -> dict[str, dict]:
+    """Download the published dimension tables as (code, label) -> [first, last] dicts.
+
+    A dimension that hasn't been published yet comes back empty.
+    """
+    dimensions = {}
+    for name in DIMENSIONS:
+        try:
+            path = hf_hub_download(repo_id=repo_id, filename=f"{name}.parquet",
+                                   repo_type="dataset", token=token)
+            dimensions[name] = dimension_rows(pq.read_table(path))
+        except (EntryNotFoundError, RepositoryNotFoundError):
+            dimensions[name] = {}
+    return dimensions
+
+
+def join_labels(con: duckdb.DuckDBPyConnection, fact: str, year_month: int | str,
+                dimensions: dict[str, str] | None = None) -> duckdb.DuckDBPyRelation:
+    """Lazy relation over a normalized fact file with its labels joined back in.
+
+    fact and dimensions are paths or URLs DuckDB can read. Each label is
+    the version whose month range covers year_month (the most recent one,
+    if a label changed back and forth) and is placed right after its code
+    column, as in data.parquet. Labels the fact file kept are left alone.
+    """
+    dimensions = dimensions or dimension_urls()
+    fact_columns = con.sql(f"SELECT * FROM read_parquet('{fact}') LIMIT 0").columns
+    code_columns = {code: (name, label) for name, (code, label) in DIMENSIONS.items()}
+
+    select, joins = [], []
+    for column in fact_columns:
+        select.append(f'f."{column}"')
+        if column not in code_columns:
+            continue
+        name, label = code_columns[column]
+        if name in dimensions and label not in fact_columns:
+            select.append(f'{name}."{label}"')
+            joins.append(
+                f"LEFT JOIN (SELECT * FROM read_parquet('{dimensions[name]}') "
+                f"WHERE {int(year_month)} BETWEEN first_month AND last_month "
+                f'QUALIFY row_number() OVER (PARTITION BY "{column}" ORDER BY first_month DESC) = 1) '
+                f'AS {name} ON f."{column}" = {name}."{column}"'
+            )
+    return con.sql(f"SELECT {', '.join(select)} FROM read_parquet('{fact}') AS f {' '.join(joins)}")
+
+
+def load_month(data_type: str, year_month: int | str,
+               con: duckdb.DuckDBPyConnection | None = None) -> duckdb.DuckDBPyRelation:
+    """Lazy relation over one published month (normalized file plus labels)."""
+    con = con or duckdb.connect()
+    return join_labels(con, normalized_url(data_type, year_month), year_month)
+
+
+def employment_month(store: str, year_month: int | str,
+                     con: duckdb.DuckDBPyConnection | None = None) -> duckdb.DuckDBPyRelation:
+    """Lazy relation rebuilding one Employment month from the keyframe + delta store.
+
+    store is a local folder or hf:// path (EMPLOYMENT_DELTAS). The result has
+    one row per distinct combination of the (text) dimension columns, with
+    the summed count and the number of source records it came from.
+    """
+    con = con or duckdb.connect()
+    year_month = int(year_month)
+    months = con.sql(
+        f"SELECT year_month, kind, effective_yyyymm FROM read_parquet('{store}/{DELTA_MONTHS_FILE}') "
+        f"WHERE year_month <= {year_month} ORDER BY year_month"
+    ).fetchall()
+    if not months or months[-1][0] != year_month:
+        raise ValueError(f"{year_month} is not in {store}")
+
+    keyframe = max(month for month, kind, _ in months if kind == "keyframe")
+    files = [f"{store}/keyframes/{keyframe}.parquet"] + [
+        f"{store}/deltas/{month}.parquet" for month, _, _ in months if month > keyframe
+    ]
+    effective = months[-1][2]
+    date = f"coalesce({DELTA_DATE_COLUMN}, '{effective}')" if effective is not None else DELTA_DATE_COLUMN
+    file_list = ", ".join(f"'{path}'" for path in files)
+    return con.sql(f"""
+        SELECT * REPLACE ({date} AS {DELTA_DATE_COLUMN}) FROM (
+            SELECT * EXCLUDE (count, records), sum(count)::BIGINT AS count, sum(records)::BIGINT AS records
+            FROM read_parquet([{file_list}], union_by_name = true)
+            GROUP BY ALL
+            HAVING sum(records) > 0
+        )
+    """)
@@ -0,0 +1,127 @@
+"""
+Per-stage timing and throughput for download_and_upload.py runs.
+
+Every navigation, download, conversion and upload is appended to a JSON-lines
+log (data/logs/run-<timestamp>.jsonl) as it finishes, with wall time, bytes,
+rows and retries. Fixed sleeps go through pause() so the time they cost is
+counted too, and event-driven waits go through wait(), which also records
+the fixed sleep each one replaced. summary() renders the end-of-run table.
+
+Compare two runs with, for example:
+
+    duckdb -c "SELECT stage, sum(seconds), sum(bytes) FROM 'data/logs/*.jsonl' GROUP BY 1"
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+RUN_LOG_DIR = Path("data/logs")
+
+# Stages in the order they appear in the summary
+STAGES = ["navigate", "download", "stream", "convert", "upload"]
+SUMMED_FIELDS = ("bytes", "parquet_bytes", "rows")  # Totalled per stage; other fields are per-item only
+
+
+class RunLog:
+    """Collects stage timings for one run and appends them to a JSON-lines file."""
+
+    def __init__(self, log_dir: Path | None = RUN_LOG_DIR):
+        self.started = time.perf_counter()
+        self.totals = defaultdict(lambda: defaultdict(float))  # stage -> field -> sum
+        self.sleeps = defaultdict(float)  # reason -> seconds
+        self.waits = defaultdict(float)  # reason -> seconds spent in event-driven waits
+        self.replaced = defaultdict(float)  # reason -> fixed sleep those waits replaced
+        self.path = None
+        self.file = None
+        if log_dir is not None:
+            log_dir.mkdir(parents=True, exist_ok=True)
+            self.path = log_dir / f"run-{datetime.now():%Y%m%d-%H%M%S}.jsonl"
+            self.file = open(self.path, "a")
+
+    def _write(self, event: dict):
+        if self.file:
+            self.file.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), **event}) + "\n")
+            self.file.flush()
+
+    def record(self, stage: str, name: str, seconds: float, **fields):
+        """Record one finished unit of work (a file, or a page of navigation).
+
+        SUMMED_FIELDS (bytes, rows, ...) are also totalled per stage for the summary.
+        """
+        totals = self.totals[stage]
+        totals["count"] += 1
+        totals["seconds"] += seconds
+        for key in SUMMED_FIELDS:
+            totals[key] += fields.get(key) or 0
+        self._write({"stage": stage, "name": name, "seconds": round(seconds, 3), **fields})
+
+    def retry(self, stage: str, name: str, error: Exception):
+        """Record a retried attempt."""
+        self.totals[stage]["retries"] += 1
+        self._write({"stage": stage, "name": name, "retry": str(error)[:200]})
+
+    async def pause(self, seconds: float, reason: str):
+        """asyncio.sleep that adds its time to the fixed-sleep total for reason."""
+        await asyncio.sleep(seconds)
+        self.sleeps[reason] += seconds
+
+    async def wait(self, awaitable, reason: str, replaces: float):
+        """Await an event-driven wait, counting its time against the fixed sleep it replaced."""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.waits[reason] += time.perf_counter() - start
+            self.replaced[reason] += replaces
+
+    def summary(self) -> str:
+        """End-of-run table of time, volume and throughput per stage."""
+        wall = time.perf_counter() - self.started
+        lines = [
+            f"{'stage':<9} {'items':>6} {'busy s':>9} {'s/item':>7} {'MB in':>9} {'MB/s':>7} "
+            f"{'rows/s':>10} {'ratio':>6} {'retries':>7}",
+        ]
+        for stage in STAGES + sorted(set(self.totals) - set(STAGES)):
+            totals = self.totals.get(stage)
+            if not totals or not totals["count"]:
+                continue
+            seconds = totals["seconds"]
+            mb = totals["bytes"] / 1e6
+            rate = lambda value: f"{value / seconds:,.0f}" if seconds and value else "-"
+            ratio = f"{totals['bytes'] / totals['parquet_bytes']:.1f}" if totals["parquet_bytes"] else "-"
+            lines.append(
+                f"{stage:<9} {totals['count']:>6.0f} {seconds:>9.1f} {seconds / totals['count']:>7.2f} "
+                f"{mb:>9.1f} {(f'{mb / seconds:.1f}' if seconds and mb else '-'):>7} "
+                f"{rate(totals['rows']):>10} {ratio:>6} {totals['retries']:>7.0f}"
+            )
+
+        slept = sum(self.sleeps.values())
+        by_reason = ", ".join(f"{reason} {seconds:.0f}s" for reason, seconds in
+                              sorted(self.sleeps.items(), key=lambda item: -item[1]))
+        lines.append(f"Fixed sleeps: {slept:.1f}s" + (f" ({by_reason})" if by_reason else ""))
+        if self.waits:
+            waited, replaced = sum(self.waits.values()), sum(self.replaced.values())
+            by_reason = ", ".join(f"{reason} {seconds:.1f}s/{self.replaced[reason]:.1f}s"
+                                  for reason, seconds in sorted(self.waits.items(), key=lambda item: -item[1]))
+            lines.append(f"Event waits: {waited:.1f}s in place of {replaced:.1f}s of fixed sleeps, "
+                         f"saved {replaced - waited:.1f}s ({by_reason})")
+        lines.append(f"Wall time: {wall:.1f}s (stages overlap, so busy time can exceed it)")
+
+        self._write({"stage": "summary", "seconds": round(wall, 3), "sleeps": dict(self.sleeps),
+                     "waits": {reason: round(seconds, 3) for reason, seconds in self.waits.items()},
+                     "replaced": dict(self.replaced),
+                     "totals": {stage: dict(totals) for stage, totals in self.totals.items()}})
+        if self.path:
+            lines.append(f"Run log: {self.path}")
+        return "\n".join(lines)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
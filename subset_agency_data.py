@@ -1,24 +1,41 @@
 """
 Subset OPM accessions and separations data for specific agencies (USDA, DOI).
-Pulls from HuggingFace, filters, combines both data types, and saves as CSV.
+Pulls from HuggingFace (or local copies, see opm_data.resolve_file), filters,
+combines both data types, and writes a CSV (or Parquet) file per agency, one
+month at a time.
 Validates that all expected months are present before saving.
+
+Months published with a stats.json sidecar (download_and_upload.py --stats)
+are checked for emptiness and skipped without downloading when they have
+no rows for the requested agencies.
 """
 
 from __future__ import annotations
 
+import argparse
+import itertools
+import json
 import re
 import sys
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from huggingface_hub import list_datasets, hf_hub_download
+from huggingface_hub import list_datasets
+from huggingface_hub.errors import EntryNotFoundError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+from opm_data import resolve_file
+
 load_dotenv()
 
 HF_USERNAME = "abigailhaddad"
+WORKERS = 8  # Months downloaded and filtered at once
 OUTPUT_DIR = Path("data/agency_subsets")
-LOCAL_CACHE_DIR = Path("data/parquet")  # Check here first before downloading
 
 # Expected date range (inclusive)
 START_YEAR_MONTH = (2015, 1)
@@ -57,15 +74,34 @@ def extract_year_month(repo_id: str) -> str | None:
     return match.group(1) if match else None
 
 
-def validate_months(repos: list[str], data_type: str) -> bool:
-    """Check that all expected months are present. Returns True if valid."""
+def load_month_stats(repo_id: str) -> dict | None:
+    """Fetch a month's stats.json sidecar, or None if it was published without one."""
+    try:
+        path = resolve_file(repo_id, "stats.json")
+    except EntryNotFoundError:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def validate_months(repos: list[str], data_type: str, stats: dict | None = None) -> bool:
+    """Check that all expected months are present. Returns True if valid.
+
+    With stats (repo_id -> stats.json contents or None), months whose
+    sidecar reports zero rows are listed as a warning. They are present,
+    just empty, and download_and_filter skips them.
+    """
     expected = get_expected_months()
     found = set()
+    empty = set()
 
     for repo_id in repos:
         ym = extract_year_month(repo_id)
         if ym:
             found.add(ym)
+            month_stats = (stats or {}).get(repo_id)
+            if month_stats and month_stats["row_count"] == 0:
+                empty.add(ym)
 
     missing = expected - found
 
@@ -76,11 +112,46 @@ def validate_months(repos: list[str], data_type: str) -> bool:
             print(f"    - {ym[:4]}-{ym[4:]}")
         return False
 
+    if empty & expected:
+        print(f"\n  WARNING: {len(empty & expected)} months for {data_type} have no rows and will be skipped:")
+        for ym in sorted(empty & expected):
+            print(f"    - {ym[:4]}-{ym[4:]}")
+
     return True
 
 
+def dropped_counts(dropped: pa.Table, date_col: str, data_type: str) -> pd.DataFrame:
+    """Summed count per (agency_code, data_type, month) for the rows dropped from one file."""
+    months = dropped.column(date_col).cast(pa.string())  # Typed files store months as integers
+    df = pd.DataFrame({
+        "agency_code": dropped.column("agency_code").cast(pa.string()).to_pandas(),
+        "month": months.to_pandas().fillna("None"),
+        "count": pd.to_numeric(dropped.column("count").to_pandas(), errors="coerce").fillna(0).astype("int64"),
+    })
+    df = df.groupby(["agency_code", "month"], as_index=False)["count"].sum()
+    df.insert(1, "data_type", data_type)
+    return df
+
+
+def summarize_dropped(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Merge per-file dropped_counts() into one row per (agency_code, data_type).
+
+    Columns: count (summed), months (distinct), first_month, last_month.
+    """
+    if not frames:
+        return pd.DataFrame(columns=["agency_code", "data_type", "count", "months", "first_month", "last_month"])
+    return (
+        pd.concat(frames, ignore_index=True)
+        .groupby(["agency_code", "data_type"])
+        .agg(count=("count", "sum"), months=("month", "nunique"),
+             first_month=("month", "min"), last_month=("month", "max"))
+        .reset_index()
+        .sort_values(["agency_code", "data_type"])
+    )
+
+
 def download_and_filter(repo_id: str, agency_codes: list[str], data_type: str,
-                        dropped_tracker: dict) -> pd.DataFrame:
+                        stats: dict | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
     """Download a dataset and filter for specific agencies.
 
     Filters on personnel_action_effective_date_yyyymm to only include data
@@ -88,45 +159,169 @@ def download_and_filter(repo_id: str, agency_codes: list[str], data_type: str,
     falls within our window (e.g., 2023 data in a 2025 file is kept if our
     range includes 2023).
 
-    Tracks dropped records in dropped_tracker dict for summary at end.
+    Returns the kept rows and dropped_counts() for the dropped ones, for
+    the summary at the end. If the month's stats sidecar shows none of the
+    agencies, nothing is downloaded.
+
+    The agency and date filters are pushed into the parquet read, so row
+    groups without matching rows are skipped and only matching rows are
+    decoded. Dropped rows are read separately, with just the columns the
+    summary needs.
     """
-    path = hf_hub_download(repo_id=repo_id, filename="data.parquet", repo_type="dataset")
-    df = pd.read_parquet(path)
+    no_drops = pd.DataFrame(columns=["agency_code", "data_type", "month", "count"])
+    if stats and not any(code in stats["agencies"] for code in agency_codes):
+        return pd.DataFrame(columns=[*stats["columns"], "data_type"]), no_drops
 
-    # Filter by agency FIRST
-    df = df[df["agency_code"].isin(agency_codes)]
+    path = resolve_file(repo_id)  # Local pipeline output or HF cache first
+    schema = pq.read_schema(path)
+    agency_filter = pc.field("agency_code").isin(agency_codes)
 
-    if len(df) == 0:
-        df["data_type"] = data_type
-        return df
-
-    # Check what would be dropped and track it
     date_col = "personnel_action_effective_date_yyyymm"
-    if date_col in df.columns:
-        start_yyyymm = f"{START_YEAR_MONTH[0]}{START_YEAR_MONTH[1]:02d}"
-        end_yyyymm = f"{END_YEAR_MONTH[0]}{END_YEAR_MONTH[1]:02d}"
+    if date_col not in schema.names:
+        df = pq.read_table(path, filters=agency_filter).to_pandas()
+        df["data_type"] = data_type
+        return df, no_drops
 
-        in_range = (df[date_col] >= start_yyyymm) & (df[date_col] <= end_yyyymm)
-        dropped = df[~in_range]
+    start_yyyymm = f"{START_YEAR_MONTH[0]}{START_YEAR_MONTH[1]:02d}"
+    end_yyyymm = f"{END_YEAR_MONTH[0]}{END_YEAR_MONTH[1]:02d}"
+    if pa.types.is_integer(schema.field(date_col).type):  # Typed files store months as integers
+        start_yyyymm, end_yyyymm = int(start_yyyymm), int(end_yyyymm)
+    month = pc.field(date_col)
+    in_range = (month >= start_yyyymm) & (month <= end_yyyymm)
 
-        if len(dropped) > 0:
-            dropped = dropped.copy()
-            dropped["count"] = pd.to_numeric(dropped["count"], errors="coerce").fillna(0)
-            for _, row in dropped.iterrows():
-                key = (row["agency_code"], data_type)
-                if key not in dropped_tracker:
-                    dropped_tracker[key] = {"count": 0, "months": set()}
-                dropped_tracker[key]["count"] += int(row["count"])
-                dropped_tracker[key]["months"].add(row[date_col])
+    df = pq.read_table(path, filters=agency_filter & in_range).to_pandas()
 
-        df = df[in_range]
+    # Check what was dropped, summed per agency and month
+    dropped = pq.read_table(
+        path, columns=["agency_code", date_col, "count"],
+        filters=agency_filter & (~in_range | month.is_null()),
+    )
 
     df["data_type"] = data_type  # Add column to distinguish accessions vs separations
-    return df
+    return df, dropped_counts(dropped, date_col, data_type)
+
+
+def map_in_order(pool: ThreadPoolExecutor, fn, items, window: int):
+    """Like pool.map, but yields futures in input order, keeping at most window calls in flight.
+
+    Finished months wait for the one before them, so results reach the
+    caller in order and only about window of them are held at once.
+    """
+    items = iter(items)
+    pending: deque[Future] = deque(pool.submit(fn, item) for item in itertools.islice(items, window))
+    while pending:
+        future = pending.popleft()
+        for item in itertools.islice(items, 1):
+            pending.append(pool.submit(fn, item))
+        yield future
+
+
+def output_schema(repos_by_type: dict[str, list[str]]) -> pa.Schema:
+    """Output columns: the union of one month's columns from each data type, plus data_type.
+
+    Separations carry columns accessions don't (e.g. separation_category),
+    so the header and Parquet schema have to be known before any month is
+    written. Where a column appears in both, the first data type's type wins.
+    """
+    fields = {}
+    for repos in repos_by_type.values():
+        if not repos:
+            continue
+        for field in parquet_schema(pq.read_schema(resolve_file(repos[0]))):
+            fields.setdefault(field.name, field)
+    fields.setdefault("data_type", pa.field("data_type", pa.string()))
+    return pa.schema(list(fields.values()))
+
+
+def parquet_schema(schema: pa.Schema) -> pa.Schema:
+    """Output schema for a month's columns.
+
+    All-null columns (Arrow null) become text, and categorical codes from
+    typed files get int32 indices, so later months with values or more
+    categories still fit.
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_null(field.type) or pa.types.is_large_string(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Cast a month to the output schema, e.g. a typed month into string output or the reverse.
+
+    Text into integer columns is converted like pd.to_numeric(errors="coerce"),
+    so non-numeric counts become null.
+    """
+    columns = []
+    for field in schema:
+        column = table.column(field.name)
+        if column.null_count == len(column):  # E.g. a column this month doesn't have
+            column = pa.nulls(len(column), field.type)
+        elif column.type != field.type:
+            if pa.types.is_integer(field.type) and not pa.types.is_integer(column.type):
+                numbers = pd.to_numeric(column.to_pandas().astype(object), errors="coerce")
+                column = pa.chunked_array([pa.array(numbers, from_pandas=True)])
+            column = column.cast(field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class AgencyWriter:
+    """Appends one agency's filtered months to its output file as they arrive.
+
+    CSV output gets one chunk per month (header first) and Parquet output one
+    row group per month, so memory doesn't grow with the number of months
+    and an interrupted run leaves the months written so far. Columns come
+    from output_schema(); months missing some of them get nulls, and a
+    month with a column outside it raises rather than losing data.
+    """
+
+    def __init__(self, path: Path, schema: pa.Schema):
+        self.path = path
+        self.schema = schema
+        self.columns = schema.names
+        self.parquet = None  # pq.ParquetWriter, for .parquet output
+        self.rows = defaultdict(int)  # data_type -> rows written
+
+    def append(self, df: pd.DataFrame):
+        if list(df.columns) != self.columns:
+            extra = [c for c in df.columns if c not in self.columns]
+            if extra:
+                raise ValueError(f"{self.path.name}: columns not in the output schema: {', '.join(extra)}")
+            df = df.reindex(columns=self.columns)
+
+        if self.path.suffix == ".parquet":
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            self.parquet.write_table(conform_table(table, self.schema))
+        else:
+            first = not self.rows
+            df.to_csv(self.path, mode="w" if first else "a", header=first, index=False)
+
+        for data_type, count in df["data_type"].value_counts().items():
+            self.rows[data_type] += count
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+            self.parquet = None
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Subset OPM accessions and separations for specific agencies")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Months to download and filter at once")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Output file format (both are written one month at a time)")
+    args = parser.parse_args()
+
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    pool = ThreadPoolExecutor(max_workers=args.workers)
 
     agency_codes = list(AGENCIES.keys())
     expected_count = len(get_expected_months())
@@ -140,41 +335,67 @@ def main():
     print(f"{'='*60}")
 
     all_repos = {}
+    all_stats = {}
     for data_type in ["accessions", "separations"]:
         repos = get_available_datasets(data_type)
         all_repos[data_type] = repos
         print(f"\n  {data_type}: found {len(repos)} datasets")
 
-        if not validate_months(repos, data_type):
+        stats = dict(zip(repos, pool.map(load_month_stats, repos)))
+        all_stats.update(stats)
+        with_stats = [s for s in stats.values() if s]
+        skippable = sum(1 for s in with_stats if not any(code in s["agencies"] for code in agency_codes))
+        print(f"  {data_type}: {len(with_stats)} months have stats, "
+              f"{skippable} have no rows for {', '.join(agency_codes)} and will be skipped")
+
+        if not validate_months(repos, data_type, stats):
             print(f"\n  ABORTING: Missing months detected. Please run the download script first.")
             sys.exit(1)
 
         print(f"  {data_type}: all {expected_count} months present")
 
-    # Collect data per agency across both data types
-    agency_dfs = {code: [] for code in agency_codes}
-    dropped_tracker = {}  # Track what's dropped for summary
-
-    for data_type in ["accessions", "separations"]:
-        print(f"\n{'='*60}")
-        print(f"Processing {data_type.upper()}")
-        print(f"{'='*60}")
-
-        repos = all_repos[data_type]
-
-        for repo_id in tqdm(repos, desc=f"Downloading {data_type}"):
-            try:
-                df = download_and_filter(repo_id, agency_codes, data_type, dropped_tracker)
+    # Write each agency's months to its file as they arrive, across both data types
+    schema = output_schema(all_repos)
+    writers = {
+        code: AgencyWriter(OUTPUT_DIR / f"{name}_accessions_separations.{args.format}", schema)
+        for code, name in AGENCIES.items()
+    }
+    dropped_frames = []  # dropped_counts() per month, for the summary
+
+    try:
+        for data_type in ["accessions", "separations"]:
+            print(f"\n{'='*60}")
+            print(f"Processing {data_type.upper()}")
+            print(f"{'='*60}")
+
+            repos = all_repos[data_type]
+
+            def fetch_month(repo_id: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+                return download_and_filter(repo_id, agency_codes, data_type, all_stats.get(repo_id))
+
+            futures = map_in_order(pool, fetch_month, repos, window=2 * args.workers)
+            for repo_id, future in tqdm(zip(repos, futures), total=len(repos), desc=f"Downloading {data_type}"):
+                try:
+                    df, dropped = future.result()
+                except Exception as e:
+                    print(f"  Error with {repo_id}: {e}")
+                    continue
+                if len(dropped) > 0:
+                    dropped_frames.append(dropped)
+                # A failed write aborts the run rather than leaving the month out of the output
                 for code in agency_codes:
                     agency_df = df[df["agency_code"] == code]
                     if len(agency_df) > 0:
-                        agency_dfs[code].append(agency_df)
-            except Exception as e:
-                print(f"  Error with {repo_id}: {e}")
-                continue
+                        writers[code].append(agency_df)
+    finally:
+        # Close even on an error or Ctrl-C, so the months written so far stay readable
+        for writer in writers.values():
+            writer.close()
+        pool.shutdown()
 
     # Print dropped data summary
-    if dropped_tracker:
+    dropped_summary = summarize_dropped(dropped_frames)
+    if len(dropped_summary) > 0:
         print(f"\n{'='*60}")
         print("DROPPED DATA SUMMARY (outside date range)")
         print(f"{'='*60}")
@@ -182,39 +403,30 @@ def main():
         end_yyyymm = f"{END_YEAR_MONTH[0]}{END_YEAR_MONTH[1]:02d}"
         print(f"  Date range: {start_yyyymm} - {end_yyyymm}\n")
 
-        for (agency_code, data_type), info in sorted(dropped_tracker.items()):
-            agency_name = next((n for c, n in AGENCIES.items() if c == agency_code), agency_code)
-            months_sorted = sorted(info["months"])
-            month_range = f"{months_sorted[0]} to {months_sorted[-1]}" if len(months_sorted) > 1 else months_sorted[0]
-            print(f"  {agency_name.upper()} {data_type}: {info['count']:,} records dropped")
-            print(f"    Months: {month_range} ({len(months_sorted)} unique months)")
+        for row in dropped_summary.itertuples():
+            agency_name = AGENCIES.get(row.agency_code, row.agency_code)
+            month_range = f"{row.first_month} to {row.last_month}" if row.months > 1 else row.first_month
+            print(f"  {agency_name.upper()} {row.data_type}: {row.count:,} records dropped")
+            print(f"    Months: {month_range} ({row.months} unique months)")
 
-    # Save combined data for each agency
+    # Report the file written for each agency
     print(f"\n{'='*60}")
-    print("SAVING COMBINED FILES")
+    print("COMBINED FILES")
     print(f"{'='*60}")
 
     for code, name in AGENCIES.items():
-        if not agency_dfs[code]:
+        writer = writers[code]
+        if not writer.rows:
             print(f"  No data for {name.upper()}")
             continue
 
-        combined = pd.concat(agency_dfs[code], ignore_index=True)
-        filename = f"{name}_accessions_separations.csv"
-        filepath = OUTPUT_DIR / filename
-        combined.to_csv(filepath, index=False)
-
-        size_mb = filepath.stat().st_size / (1024 * 1024)
-        accessions_count = len(combined[combined["data_type"] == "accessions"])
-        separations_count = len(combined[combined["data_type"] == "separations"])
-
+        size_mb = writer.path.stat().st_size / (1024 * 1024)
         print(f"\n  {name.upper()} ({code}):")
-        print(f"    File: {filepath}")
-        print(f"    Accessions rows: {accessions_count:,}")
-        print(f"    Separations rows: {separations_count:,}")
-        print(f"    Total rows: {len(combined):,}")
+        print(f"    File: {writer.path}")
+        print(f"    Accessions rows: {writer.rows['accessions']:,}")
+        print(f"    Separations rows: {writer.rows['separations']:,}")
+        print(f"    Total rows: {sum(writer.rows.values()):,}")
         print(f"    Size: {size_mb:.2f} MB")
 
-
 if __name__ == "__main__":
     main()